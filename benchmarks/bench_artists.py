@@ -0,0 +1,62 @@
+"""
+Compare how the number of matplotlib artists and the render time of a
+row scale with the number of landmarks, for the legacy per-landmark
+drawing calls and for the batched ones used by ``Markimg.run``.
+
+    python benchmarks/bench_artists.py
+"""
+
+import io
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from markimg.markimg import Markimg
+
+WIDTH = 1000
+HEIGHT = 3000
+LANDMARK_COUNTS = [4, 16, 64, 256, 1024]
+
+
+def render(app, n_landmarks, batched):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, WIDTH, size=(n_landmarks, 2)).tolist()
+    fig = plt.figure(figsize=(WIDTH / 100, HEIGHT / 100))
+    plt.imshow(np.zeros((HEIGHT, WIDTH), dtype=np.uint8), cmap='gray')
+
+    start = time.perf_counter()
+    if batched:
+        app.drawPoints(points, 'x', 'red', 10)
+        segments = []
+        for i in range(0, n_landmarks - 1, 2):
+            segments.extend(app.xLineSegments(points[i], points[i + 1], HEIGHT, f'Right {i}'))
+        app.drawLines(segments, 'red', 1)
+    else:
+        # legacy behaviour: one scatter per landmark, one plt.plot per segment
+        for point in points:
+            app.drawPoint(point, 'x', 'red', 10)
+        for i in range(0, n_landmarks - 1, 2):
+            for (x1, y1), (x2, y2) in app.xLineSegments(points[i], points[i + 1], HEIGHT, f'Right {i}'):
+                plt.plot([x1, x2], [y1, y2], color='red', linewidth=1)
+    artists = len(plt.gca().collections) + len(plt.gca().lines)
+    fig.savefig(io.BytesIO(), format='jpg')
+    elapsed = time.perf_counter() - start
+    plt.close(fig)
+    return artists, elapsed
+
+
+def main():
+    app = Markimg()
+    print(f"{'landmarks':>10} {'legacy artists':>15} {'batched artists':>16} "
+          f"{'per-call (s)':>13} {'batched (s)':>12}")
+    for n in LANDMARK_COUNTS:
+        legacy, t_single = render(app, n, batched=False)
+        batched, t_batched = render(app, n, batched=True)
+        print(f"{n:>10} {legacy:>15} {batched:>16} {t_single:>13.3f} {t_batched:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
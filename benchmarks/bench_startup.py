@@ -0,0 +1,125 @@
+"""
+Measure the startup of a fresh process and the render time of its first
+rows, with a cold matplotlib font cache (as on a container without a baked
+cache) and with the cache built by ``markimg --warmup``. Each column is the
+median over PROCESSES fresh processes.
+
+The benchmark fails unless the baked cache removes the build of the font
+cache from startup: no process using it may write the cache, and their import
+must be faster than with a cold cache. first/later, the time of the first row
+over the median time of the following ones, is only reported. The first row
+of a fresh process stays slightly slower than later rows whatever the cache,
+as it is the first to touch the memory that later rows reuse.
+
+    python benchmarks/bench_startup.py
+"""
+
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+WIDTH = 600
+HEIGHT = 1600
+ROWS = 5
+PROCESSES = 5
+
+ROW = {
+    'origHeight': 1500,
+    'info': {'PatientID': '123', 'StudyDate': '20230101'},
+    'details': {'AccessionNumber': 'A1'},
+    'landmarks': [{'a': {'x': 100, 'y': 300}}, {'b': {'x': 150, 'y': 700}},
+                  {'c': {'x': 160, 'y': 800}}, {'d': {'x': 170, 'y': 1300}},
+                  {'e': {'x': 450, 'y': 320}}, {'f': {'x': 420, 'y': 720}},
+                  {'g': {'x': 430, 'y': 790}}, {'h': {'x': 440, 'y': 1250}}],
+    'drawXLine': [{'Right femur': {'start': 'a', 'end': 'b'}}, {'Right tibia': {'start': 'c', 'end': 'd'}},
+                  {'Left femur': {'start': 'e', 'end': 'f'}}, {'Left tibia': {'start': 'g', 'end': 'h'}}],
+    'measureXDist': ['Right femur', 'Right tibia', 'Left femur', 'Left tibia'],
+}
+
+
+def child(workdir):
+    """
+    Start up as the markimg command does and render ROWS rows, printing the
+    timings as JSON.
+    """
+    l_caches = glob.glob(os.path.join(os.environ['MPLCONFIGDIR'], 'fontlist-*.json'))
+    d_cache_times = {path: os.stat(path).st_mtime_ns for path in l_caches}
+    start = time.perf_counter()
+    from loguru import logger
+    from markimg.markimg import Markimg
+    d_timings = {'import': time.perf_counter() - start}
+    l_caches = glob.glob(os.path.join(os.environ['MPLCONFIGDIR'], 'fontlist-*.json'))
+    d_timings['built_cache'] = any(d_cache_times.get(path) != os.stat(path).st_mtime_ns
+                                   for path in l_caches)
+    logger.remove()
+
+    app = Markimg()
+    image_path = os.path.join(workdir, 'in', 'leg.png')
+    options = app.parse_args([os.path.join(workdir, 'in'), os.path.join(workdir, 'out')])
+    d_timings['rows'] = []
+    for i in range(ROWS):
+        start = time.perf_counter()
+        app.processRow(f'row{i}', ROW, image_path, options)
+        d_timings['rows'].append(time.perf_counter() - start)
+    print(json.dumps(d_timings))
+
+
+def run(workdir, cachedir):
+    env = dict(os.environ, MPLCONFIGDIR=cachedir)
+    result = subprocess.run([sys.executable, __file__, '--child', workdir], env=env,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    import cv2
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'in'))
+        os.makedirs(os.path.join(workdir, 'out'))
+        cv2.imwrite(os.path.join(workdir, 'in', 'leg.png'),
+                    np.random.default_rng(0).integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8))
+        baked = tempfile.mkdtemp(dir=workdir)
+        subprocess.run([sys.executable, '-m', 'markimg', '--warmup'], check=True,
+                       capture_output=True, env=dict(os.environ, MPLCONFIGDIR=baked))
+
+        print(f"{'font cache':>10} {'import (s)':>11} {'first row (s)':>14} "
+              f"{'later rows (s)':>15} {'first/later':>12}")
+        d_imports = {}
+        d_built = {}
+        for name, cachedir in (('cold', None), ('baked', baked)):
+            l_imports, l_first, l_later, l_ratios, l_built = [], [], [], [], []
+            for i in range(PROCESSES):
+                # the first process to run builds the cache, so every cold
+                # process gets a new empty one
+                d_timings = run(workdir, cachedir or tempfile.mkdtemp(dir=workdir))
+                l_imports.append(d_timings['import'])
+                l_first.append(d_timings['rows'][0])
+                l_later.append(statistics.median(d_timings['rows'][1:]))
+                l_ratios.append(l_first[-1] / l_later[-1])
+                l_built.append(d_timings['built_cache'])
+            d_imports[name] = statistics.median(l_imports)
+            d_built[name] = sum(l_built)
+            print(f"{name:>10} {d_imports[name]:>11.3f} "
+                  f"{statistics.median(l_first):>14.3f} {statistics.median(l_later):>15.3f} "
+                  f"{statistics.median(l_ratios):>12.2f}")
+
+    if d_built['cold'] != PROCESSES:
+        sys.exit("A process with a cold cache did not build it, the benchmark measures nothing")
+    if d_built['baked']:
+        sys.exit(f"{d_built['baked']} of {PROCESSES} processes rebuilt the baked font cache")
+    if d_imports['baked'] >= d_imports['cold']:
+        sys.exit("The baked font cache did not make the import faster")
+    print(f"The baked font cache saves {d_imports['cold'] - d_imports['baked']:.3f} s of startup")
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,275 @@
+"""
+Pools of image buffers reused from row to row.
+Large images otherwise cost a fresh multi-hundred-MB allocation per stage and
+per row; pooled buffers are allocated once per process and recycled.
+
+BufferPool holds the private buffers of the stages of a row within a process,
+from the render to the rotated output image. SharedImagePool holds segments
+of shared memory through which the decoded input image of a row is handed
+from the process scheduling the rows to the worker rendering it: the worker
+maps the segment named by a SharedImage instead of receiving a pickled copy.
+The segments are bounded by the free space of /dev/shm, as tmpfs reserves
+nothing when a segment is created and a process writing to a full one is
+killed with SIGBUS.
+"""
+
+import math
+import os
+import sys
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Free buffers kept for reuse, at most one per stage of a row
+MAX_FREE_BUFFERS = 4
+# A free buffer is not reused for a request this many times smaller,
+# it is released instead so the memory goes back to the system
+MAX_WASTE_RATIO = 4
+SHM_DIR = '/dev/shm'
+# Fraction of the free space of /dev/shm given to shared images
+SHM_HEADROOM = 0.5
+
+
+class Buffer:
+    """
+    A block of memory from the pool, and the array currently viewing it.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.memory = np.empty(capacity, dtype=np.uint8)
+        self.array = None
+
+    def view(self, shape: tuple, dtype) -> np.ndarray:
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.memory)
+        return self.array
+
+
+class BufferPool:
+    def __init__(self):
+        self.l_free = []
+
+    def acquire(self, shape: tuple, dtype=np.uint8) -> Buffer:
+        """
+        Return a buffer holding an array of the given shape and type,
+        reusing the smallest free buffer large enough.
+        """
+        nbytes = max(math.prod(shape) * np.dtype(dtype).itemsize, 1)
+        l_fit = [buffer for buffer in self.l_free
+                 if nbytes <= buffer.capacity <= nbytes * MAX_WASTE_RATIO]
+        if l_fit:
+            buffer = min(l_fit, key=lambda b: b.capacity)
+            self.l_free.remove(buffer)
+        else:
+            buffer = Buffer(nbytes)
+        buffer.view(shape, dtype)
+        return buffer
+
+    def release(self, *buffers: Buffer) -> None:
+        """
+        Give buffers back to the pool once their arrays are no longer used.
+        """
+        for buffer in buffers:
+            if buffer is not None:
+                buffer.array = None
+                self.l_free.append(buffer)
+        # keep the most recent buffers, which are sized for the current images
+        del self.l_free[:-MAX_FREE_BUFFERS]
+
+    def writer(self, transform=None) -> 'BufferWriter':
+        """
+        Return a file-like object writing into a buffer of the pool,
+        e.g. for plt.savefig(format='rgba'). If given, transform is called
+        with the arrays written, as a view of the caller's memory, and
+        returns the buffer to store instead, e.g. a resized copy.
+        """
+        return BufferWriter(self, transform)
+
+    def close(self) -> None:
+        self.l_free = []
+
+
+class BufferWriter:
+    """
+    Binary file-like object storing what is written to it in a pooled buffer.
+    """
+    def __init__(self, pool: BufferPool, transform=None):
+        self.pool = pool
+        self.transform = transform
+        self.buffer = None
+        self.size = 0
+        self.shape = None
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        if data.ndim > 1:
+            # e.g. the (height, width, 4) RGBA buffer of a matplotlib renderer
+            if self.transform is not None:
+                if self.buffer is not None:
+                    raise OSError("BufferWriter only transforms a single array")
+                self.buffer = self.transform(np.asarray(data))
+                self.shape = self.buffer.array.shape
+                self.size = self.buffer.array.nbytes
+                return data.nbytes
+            self.shape = data.shape
+        data = np.frombuffer(data.cast('B'), dtype=np.uint8)
+        if self.buffer is None:
+            self.buffer = self.pool.acquire((len(data),))
+        elif self.size + len(data) > self.buffer.capacity:
+            # rare: grow to twice the size, keeping what was written
+            buffer = self.pool.acquire((2 * (self.size + len(data)),))
+            buffer.memory[:self.size] = self.buffer.memory[:self.size]
+            self.pool.release(self.buffer)
+            self.buffer = buffer
+        self.buffer.memory[self.size:self.size + len(data)] = data
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # only what matplotlib needs to accept this as a file handle
+        if whence != os.SEEK_SET or offset > self.size:
+            raise OSError("BufferWriter only seeks backwards from the start")
+        self.size = offset
+        return self.size
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self) -> None:
+        pass
+
+    def array(self, shape: tuple = None, dtype=np.uint8) -> np.ndarray:
+        """
+        Return what was written as an array of the given shape, by default
+        the shape of the array which was written.
+        """
+        return self.buffer.view(shape or self.shape or (self.size,), dtype)
+
+
+_pool = None
+
+
+def buffer_pool() -> BufferPool:
+    """
+    Return the buffer pool of the current process.
+    """
+    global _pool
+    if _pool is None:
+        _pool = BufferPool()
+    return _pool
+
+
+def shm_budget() -> int:
+    """
+    Return the number of bytes of shared memory which the images handed to
+    worker processes may use, 0 if there is no shared memory.
+    """
+    try:
+        stat = os.statvfs(SHM_DIR)
+    except OSError:
+        return 0
+    return int(stat.f_bavail * stat.f_frsize * SHM_HEADROOM)
+
+
+class SharedImage:
+    """
+    Picklable reference to an image in a segment of a SharedImagePool.
+    The process it is sent to maps the image without copying it, using the
+    reference as a context manager:
+
+        with shared_image:
+            render(shared_image.array)
+    """
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.shm = None
+        self.array = None
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __enter__(self) -> 'SharedImage':
+        if sys.version_info >= (3, 13):
+            # the pool's process owns the segment and unlinks it
+            self.shm = shared_memory.SharedMemory(name=self.name, track=False)
+        else:
+            # registers the name again with the resource tracker, which worker
+            # processes share with the pool's process, so this is a no-op
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        self.array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=self.shm.buf)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if tb is not None:
+            # the frames of the error still reference the array, which
+            # would keep the segment from being unmapped
+            traceback.clear_frames(tb)
+        self.array = None
+        self.shm.close()
+        self.shm = None
+
+
+class SharedImagePool:
+    """
+    Segments of shared memory holding the images handed to other processes,
+    reused from row to row. The segments never exceed budget bytes in total,
+    and all of them are unlinked when the pool is closed.
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.l_free = []
+        self.d_used = {}
+
+    def size(self) -> int:
+        return sum(shm.size for shm in self.l_free + list(self.d_used.values()))
+
+    def put(self, image: np.ndarray):
+        """
+        Copy an image into a segment of the pool, reusing the smallest free
+        segment large enough.
+        :param image: the image
+        :return: the SharedImage referencing the copy, or None if the image
+                 does not fit within the budget
+        """
+        nbytes = max(image.nbytes, 1)
+        l_fit = [shm for shm in self.l_free if nbytes <= shm.size <= nbytes * MAX_WASTE_RATIO]
+        if l_fit:
+            shm = min(l_fit, key=lambda s: s.size)
+            self.l_free.remove(shm)
+        else:
+            # make room by dropping the free segments, oldest first
+            while self.l_free and self.size() + nbytes > self.budget:
+                self.__unlink(self.l_free.pop(0))
+            if self.size() + nbytes > self.budget:
+                return None
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.d_used[shm.name] = shm
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        return SharedImage(shm.name, image.shape, image.dtype.str)
+
+    def release(self, image: SharedImage) -> None:
+        """
+        Give the segment of an image back to the pool once the process it
+        was handed to is done with it.
+        """
+        self.l_free.append(self.d_used.pop(image.name))
+        while len(self.l_free) > MAX_FREE_BUFFERS:
+            self.__unlink(self.l_free.pop(0))
+
+    def __unlink(self, shm: shared_memory.SharedMemory) -> None:
+        shm.close()
+        shm.unlink()
+
+    def close(self) -> None:
+        """
+        Unlink all the segments, including those of images still in use.
+        """
+        for shm in self.l_free + list(self.d_used.values()):
+            self.__unlink(shm)
+        self.l_free = []
+        self.d_used = {}
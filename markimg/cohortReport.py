@@ -0,0 +1,158 @@
+"""
+A typed, columnar report of every row processed by a run, written as CSV
+and/or Parquet next to the per-row JSON files. Lengths and differences are
+numbers rather than strings, so a cohort can be queried from a single report.
+Rows are appended as they are rendered: the CSV file is flushed after each
+row. The Parquet report is a dataset directory of part files, each a complete
+Parquet file written at the end of a batch of rows, after PARQUET_ROW_GROUP
+rows or after PARQUET_FLUSH_INTERVAL seconds, so that the report can be read
+while a long run goes on and a killed run only loses its pending rows.
+"""
+
+import csv
+import glob
+import json
+import os
+import shutil
+import time
+
+COHORT_FILE = 'cohort-report'
+FORMATS = ('csv', 'parquet')
+PARQUET_ROW_GROUP = 1024
+# pending rows are written once the oldest of them is this old (in seconds)
+PARQUET_FLUSH_INTERVAL = 60
+
+# column name, type and the key of the value in the row's report JSON
+COLUMNS = [
+    ('row', 'string', None),
+    ('unit', 'string', None),
+    ('femur_right', 'float', 'FEMUR RIGHT'),
+    ('femur_left', 'float', 'FEMUR LEFT'),
+    ('femur_diff', 'float', 'FEMUR DIFF'),
+    ('femur_laterality', 'string', 'FEMUR LATERALITY'),
+    ('tibia_right', 'float', 'TIBIA RIGHT'),
+    ('tibia_left', 'float', 'TIBIA LEFT'),
+    ('tibia_diff', 'float', 'TIBIA DIFF'),
+    ('tibia_laterality', 'string', 'TIBIA LATERALITY'),
+    ('total_right', 'float', 'TOTAL RIGHT'),
+    ('total_left', 'float', 'TOTAL LEFT'),
+    ('total_diff', 'float', 'TOTAL DIFF'),
+    ('total_laterality', 'string', 'TOTAL LATERALITY'),
+    ('info', 'string', None),
+    ('details', 'string', None),
+]
+
+
+def cohort_record(row: str, d_analysis: dict, d_report: dict) -> dict:
+    """
+    Build the typed record of a row from its analysis and report JSON.
+    The 'info' and 'details' fields, which vary between studies, are kept
+    as JSON encoded strings.
+    :param row: name of the row
+    :param d_analysis: the row's entry of the analysis JSON
+    :param d_report: the row's report JSON
+    :return: the record, keyed by column name
+    """
+    d_record = {
+        'row': row,
+        'unit': d_analysis['femur']['Right femur'].rsplit(' ', 1)[-1],
+        'info': json.dumps(d_analysis['info']),
+        'details': json.dumps(d_analysis['details']),
+    }
+    for column, kind, key in COLUMNS:
+        if key is None:
+            continue
+        if kind == 'float':
+            d_record[column] = float(d_report[key])
+        else:
+            # compareLength() reports equal lengths as 'equal:'
+            d_record[column] = d_report[key].rstrip(':')
+    return d_record
+
+
+class CohortReport:
+    """
+    Writer appending the records of rows to the cohort report files.
+    """
+    def __init__(self, outputdir: str, formats: list, append: bool = False):
+        """
+        :param outputdir: directory of the report files
+        :param formats: formats of the report, see FORMATS
+        :param append: add to the report of an earlier run, e.g. of a
+                       restarted watcher, rather than starting a new one
+        """
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"Unsupported cohort report formats: {', '.join(sorted(unknown))}")
+        self.l_columns = [column for column, kind, key in COLUMNS]
+        self.csv_file = None
+        self.csv_writer = None
+        self.parquet_dir = None
+        self.l_pending = []
+        self.pending_since = 0.0
+        if 'csv' in formats:
+            self.csv_file = open(os.path.join(outputdir, f'{COHORT_FILE}.csv'), 'a' if append else 'w',
+                                 newline='')
+            self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=self.l_columns)
+            if self.csv_file.tell() == 0:
+                self.csv_writer.writeheader()
+        if 'parquet' in formats:
+            # pyarrow is only needed, and imported, for Parquet output
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.pa = pa
+            self.pq = pq
+            types = {'string': pa.string(), 'float': pa.float64()}
+            self.schema = pa.schema([(column, types[kind]) for column, kind, key in COLUMNS])
+            self.parquet_dir = os.path.join(outputdir, f'{COHORT_FILE}.parquet')
+            if not append and os.path.isdir(self.parquet_dir):
+                shutil.rmtree(self.parquet_dir)
+            elif os.path.isfile(self.parquet_dir):
+                # single file report of an older version
+                os.remove(self.parquet_dir)
+            os.makedirs(self.parquet_dir, exist_ok=True)
+            # parts of a killed run which were not complete
+            for tmp_path in glob.glob(os.path.join(self.parquet_dir, '.part-*.tmp')):
+                os.remove(tmp_path)
+            l_parts = glob.glob(os.path.join(self.parquet_dir, 'part-*.parquet'))
+            self.part = max((int(os.path.basename(path)[5:10]) for path in l_parts), default=-1) + 1
+
+    def append(self, d_record: dict) -> None:
+        """
+        Append the record of a row to the report.
+        """
+        if self.csv_writer:
+            self.csv_writer.writerow(d_record)
+            self.csv_file.flush()
+        if self.parquet_dir:
+            if not self.l_pending:
+                self.pending_since = time.monotonic()
+            self.l_pending.append(d_record)
+            if len(self.l_pending) >= PARQUET_ROW_GROUP or \
+                    time.monotonic() - self.pending_since >= PARQUET_FLUSH_INTERVAL:
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the pending rows to a new Parquet part file, e.g. once a batch
+        of rows is done.
+        """
+        if not self.l_pending:
+            return
+        name = f'part-{self.part:05d}.parquet'
+        # readers of the dataset skip hidden files, so a part only appears
+        # once it is complete
+        tmp_path = os.path.join(self.parquet_dir, f'.{name}.tmp')
+        self.pq.write_table(self.pa.Table.from_pylist(self.l_pending, schema=self.schema), tmp_path)
+        os.replace(tmp_path, os.path.join(self.parquet_dir, name))
+        self.part += 1
+        self.l_pending = []
+
+    def close(self) -> None:
+        """
+        Write the remaining rows and close the report files.
+        """
+        if self.csv_file:
+            self.csv_file.close()
+        if self.parquet_dir:
+            self.flush()
@@ -0,0 +1,220 @@
+"""
+Helpers to find the input image of a row and read it in its native format.
+Grayscale radiographs are kept single-channel (8 or 16 bit) instead of being
+expanded to 3-channel 8-bit BGR; the promotion to colour only happens when
+matplotlib composites the image with the annotations.
+
+DICOM files are read directly. Their pixel data is only decoded when it is
+accessed, so reading the header (e.g. for the pixel spacing) stays cheap.
+"""
+
+import fnmatch
+import os
+
+import cv2
+import numpy as np
+import pydicom
+from PIL import Image, UnidentifiedImageError
+
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+# transfer syntax of a raw DICOM dataset, by (implicit VR, little endian)
+RAW_TRANSFER_SYNTAXES = {
+    (True, True): pydicom.uid.ImplicitVRLittleEndian,
+    (False, True): pydicom.uid.ExplicitVRLittleEndian,
+    (False, False): pydicom.uid.ExplicitVRBigEndian,
+}
+
+
+def find_images(inputdir: str, image_name: str, top: str = None) -> dict:
+    """
+    Map the name of every directory of the input directory to the input
+    images below it, at any depth, in a single walk of the tree. Hidden
+    files and directories are skipped. See row_image() for the image of a row.
+    :param inputdir: the input directory
+    :param image_name: name (or glob pattern) of the input images
+    :param top: if given, only look at this file or directory of the input directory
+    :return: sorted list of image paths per directory name
+    """
+    if top is not None and os.path.isfile(top):
+        l_walk = [(os.path.dirname(top), [], [os.path.basename(top)])]
+    else:
+        l_walk = os.walk(top or inputdir)
+    d_images = {}
+    for root, dirs, files in l_walk:
+        dirs[:] = [dir for dir in dirs if not dir.startswith('.')]
+        l_dirs = os.path.relpath(root, inputdir).split(os.sep)
+        if any(dir.startswith('.') and dir != '.' for dir in l_dirs):
+            continue
+        for name in fnmatch.filter(files, image_name):
+            if not name.startswith('.'):
+                for dir in l_dirs:
+                    d_images.setdefault(dir, []).append(os.path.join(root, name))
+    for l_images in d_images.values():
+        l_images.sort()
+    return d_images
+
+
+def row_image(d_images: dict, row: str):
+    """
+    Return the input image of a row: the first of the images found below
+    the directories named after the row, or None if there is none.
+    :param d_images: the result of find_images()
+    :param row: name of the row
+    """
+    l_images = d_images.get(row)
+    return l_images[0] if l_images else None
+
+
+def read_image(path: str, grayscale: bool = False) -> np.ndarray:
+    """
+    Read an image from disk without changing its depth or channel count.
+    Colour images are returned in RGB(A) order, as expected by matplotlib.
+    :param path: path of the image file
+    :param grayscale: force decoding to a single channel
+    :return: the decoded image
+    """
+    if grayscale:
+        flags = cv2.IMREAD_GRAYSCALE | cv2.IMREAD_ANYDEPTH
+    else:
+        flags = cv2.IMREAD_UNCHANGED
+    image = cv2.imread(path, flags)
+    if image is None:
+        raise ValueError(f"Unable to read image {path}")
+    return to_display_order(image)
+
+
+def decode_image(path: str, grayscale: bool = False) -> np.ndarray:
+    """
+    Decode the image of a row as it is displayed, whether DICOM or not.
+    :param path: path of the image file
+    :param grayscale: force decoding to a single channel
+    :return: the decoded image
+    """
+    if is_dicom(path):
+        return dicom_image(read_dicom(path), grayscale)
+    return read_image(path, grayscale)
+
+
+def probe_image(path: str) -> (int, int):
+    """
+    Return the dimensions of an image as it is displayed, reading only
+    its header when the format allows it.
+    :param path: path of the image file
+    :return: width and height in pixels
+    """
+    if is_dicom(path):
+        ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+        # dicom_image rotates the pixels by 90 degrees
+        return int(ds.Rows), int(ds.Columns)
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except UnidentifiedImageError:
+        height, width = read_image(path).shape[:2]
+        return width, height
+
+
+def is_dicom(path: str) -> bool:
+    """
+    Check whether a file is a DICOM file, from its extension or its preamble.
+    :param path: path of the image file
+    :return: True for DICOM files
+    """
+    if path.lower().endswith(DICOM_EXTENSIONS):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    except OSError:
+        return False
+
+
+def read_dicom(path: str) -> pydicom.Dataset:
+    """
+    Read a DICOM file, deferring the read of its pixel data until
+    the pixels are accessed. Raw datasets, without the preamble and file
+    meta information of a DICOM file, are read as well.
+    :param path: path of the DICOM file
+    :return: the DICOM dataset
+    """
+    # is_dicom() also accepts files by their extension, which raw exports
+    # share with DICOM files
+    ds = pydicom.dcmread(path, defer_size='1 KB', force=True)
+    if 'TransferSyntaxUID' not in ds.file_meta:
+        ds.file_meta.TransferSyntaxUID = RAW_TRANSFER_SYNTAXES[ds.original_encoding]
+    return ds
+
+
+def dicom_height(ds: pydicom.Dataset) -> float:
+    """
+    Return the physical height of a DICOM image in mm, from its pixel
+    spacing or, failing that, from its field of view dimensions.
+    :param ds: DICOM dataset as returned by read_dicom
+    :return: the height in mm, or 0 if the header does not provide it
+    """
+    for keyword in ('PixelSpacing', 'ImagerPixelSpacing'):
+        spacing = ds.get(keyword)
+        if spacing and 'Rows' in ds:
+            return float(spacing[0]) * int(ds.Rows)
+    fov = ds.get('FieldOfViewDimensions')
+    if fov:
+        return float(fov[0])
+    return 0
+
+
+def dicom_image(ds: pydicom.Dataset, grayscale: bool = False) -> np.ndarray:
+    """
+    Decode the pixel data of a DICOM dataset. The image is rotated by 90
+    degrees counter-clockwise, the orientation of the PNG images produced by
+    the upstream conversion which the landmark coordinates refer to.
+    :param ds: DICOM dataset as returned by read_dicom
+    :param grayscale: force a single channel image
+    :return: the decoded image
+    """
+    image = ds.pixel_array
+    if int(ds.get('NumberOfFrames') or 1) > 1:
+        image = image[0]
+    if image.ndim == 3:
+        if grayscale:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        elif image.dtype == np.uint16:
+            image = (image >> 8).astype(np.uint8)
+    elif ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+        image = image.max() - image
+    return np.ascontiguousarray(np.rot90(image))
+
+
+def to_display_order(image: np.ndarray) -> np.ndarray:
+    """
+    Convert a decoded OpenCV image to what matplotlib can show: single
+    channel images stay 2D, colour images become 8-bit RGB(A).
+    :param image: image as returned by cv2
+    :return: image ready for plt.imshow
+    """
+    if image.ndim == 3 and image.shape[2] == 1:
+        return image[:, :, 0]
+    if image.ndim == 2:
+        return image
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def display_args(image: np.ndarray) -> dict:
+    """
+    Return the plt.imshow keyword arguments needed to show the image.
+    Single channel images are windowed over their full dtype range when
+    8 bit, and over their actual value range otherwise.
+    :param image: image as returned by read_image
+    :return: keyword arguments for plt.imshow
+    """
+    if image.ndim != 2:
+        return {}
+    if image.dtype == np.uint8:
+        vmin, vmax = 0, 255
+    else:
+        vmin, vmax = image.min(), image.max()
+    return {'cmap': 'gray', 'vmin': vmin, 'vmax': vmax}
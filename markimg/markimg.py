@@ -8,21 +8,36 @@
 #                        dev@babyMRI.org
 #
 
+import copy
+import functools
 import glob
 import json
 import math
+import multiprocessing
 import os
+import signal
 import sys
+from argparse import ArgumentParser
 import cv2
 from PIL import Image
-import matplotlib
 import matplotlib.pyplot as plt
-from chrisapp.base import ChrisApp
+from matplotlib.collections import LineCollection
+from chrisapp.base import ChrisApp, NoArgAction
 from loguru import logger
+from markimg.bufferPool import buffer_pool, shm_budget, SharedImagePool, SHM_DIR
+from markimg.cohortReport import CohortReport, cohort_record
 from markimg.imageCanvas import ImageCanvas
+from markimg.imageReader import read_image, display_args, is_dicom, read_dicom, dicom_height, dicom_image, probe_image, \
+    find_images, row_image, decode_image
+from markimg.profiler import profile_path, profile_row, write_collapsed
+from markimg.roi import CROP_MODES, crop_boxes, output_slices, render_transform
+from markimg.style import apply_style, warm_up
+from markimg.validator import validate
+from markimg.watcher import StudyWatcher
+from markimg.scheduler import run_admitted, estimate_row_memory, memory_limit, cpu_count, MEMORY_HEADROOM
 import numpy as np
 
-matplotlib.rcParams['font.family'] = 'monospace'
+apply_style()
 LOG = logger.debug
 
 logger_format = (
@@ -74,9 +89,17 @@ Gstr_synopsis = """
             [--addTextPos <additionalTextPosition>]                     \\
             [--addTextColor <additionalTextColor>]                      \\
             [--addTextOffset <additionalTextOffsetPosition>]            \\
+            [--grayscale]                                               \\
+            [--maxWorkers <maxWorkers>]                                 \\
+            [--profile <DIR>]                                           \\
+            [--cohortReport <formats>]                                  \\
+            [--watch] [--watchInterval <seconds>]                       \\
+            [--validate] [--skipInvalid]                                \\
+            [--crop <mode>] [--cropMargin <pixels>]                     \\
             [-h] [--help]                                               \\
             [--json]                                                    \\
             [--man]                                                     \\
+            [--warmup]                                                  \\
             [--meta]                                                    \\
             [--savejson <DIR>]                                          \\
             [-v <level>] [--verbosity <level>]                          \\
@@ -106,7 +129,9 @@ Gstr_synopsis = """
         Default is 'prediction.json'.
 
         [-i|--inputImageName <pngFileName>]
-        The name of the input image file.
+        The name of the input image file. DICOM files are read directly,
+        in which case the cm scale is taken from the pixel spacing (or
+        field of view) in the DICOM header instead of 'origHeight'.
         Default is 'leg.png'.
 
         [-p|--pointMarker <pointMarker>]
@@ -183,7 +208,73 @@ Gstr_synopsis = """
         If specified, move the additional text using the offset 
         coordinates (x,y). Accepts a tuple in the form of "x,y"
         
-                       
+        [--grayscale]
+        If specified, decode the input image as a single channel. Images
+        are otherwise read with their native depth and channels, so
+        grayscale and 16-bit inputs are kept single-channel.
+
+        [--maxWorkers <maxWorkers>]
+        The maximum number of rows rendered at once. Rows are only
+        started while their estimated memory use fits in the container's
+        memory limit, so large images are rendered one at a time.
+        The input images of rows rendered at once are decoded into shared
+        memory (/dev/shm) and mapped by the rendering processes without a
+        copy; an image which does not fit in half of the free space of
+        /dev/shm is read by its rendering process instead.
+        Default is 0, which uses all available CPUs.
+
+        [--profile <DIR>]
+        If specified, run each row under cProfile and tracemalloc and save
+        to DIR a <row>.pstats file and a <row>-allocations.txt summary of
+        the top allocations per row, plus a markimg.collapsed stack file
+        of the whole run for flame graph tools.
+
+        [--cohortReport <formats>]
+        If specified, also save a typed, columnar report of all the rows
+        in the given comma separated formats, 'csv' and/or 'parquet', as
+        cohort-report.csv and cohort-report.parquet, a dataset directory
+        of Parquet part files. Lengths and differences are numbers, the
+        'info' and 'details' fields are JSON strings. Rows are appended
+        as they are rendered, and a Parquet part is written after each
+        batch of rows and at least every minute.
+
+        [--watch]
+        If specified, keep watching the input directory and process each
+        study (a row of any input JSON) once its JSON and image are both
+        present and stable, saving it to its own <row>-analysis.json and
+        <row>-report.json. Processed studies are recorded in
+        markimg-index.json in the output directory and are only processed
+        again if their files change. Uses inotify when available, polling
+        otherwise.
+
+        [--watchInterval <seconds>]
+        In watch mode, the time the files of a study must be unchanged for
+        before it is processed, and the polling interval.
+        Default is 2.
+
+        [--validate]
+        If specified, check all the rows in parallel before rendering any:
+        each row must have exactly one input image with a readable header,
+        and all the landmarks, lines and measurements (including the right
+        and left femur and tibia) needed to render it. Problems are saved
+        to validation-report.json, and the run fails if any row is invalid.
+
+        [--skipInvalid]
+        If specified with --validate, skip the invalid rows and process
+        the others instead of failing.
+
+        [--crop <mode>]
+        If specified, also save cropped outputs around the measured bones,
+        cut from the annotated output image: 'bones' saves one crop per
+        measured bone as <row>-<bone>.<ext> (e.g. study-Right_femur.jpg),
+        'annotated' saves a single crop of all the measurements as
+        <row>-crop.<ext>. The crops are bounded by the landmarks and the
+        measurement lines.
+
+        [--cropMargin <pixels>]
+        The margin around the crops, in input image pixels.
+        Default is 50.
+
         [-h] [--help]
         If specified, show help message and exit.
 
@@ -193,6 +284,11 @@ Gstr_synopsis = """
         [--man]
         If specified, print (this) man page and exit.
 
+        [--warmup]
+        If specified, build the matplotlib font cache, resolve the fonts of
+        the output images and exit. Run while building the container image
+        so that the cache is part of the image.
+
         [--meta]
         If specified, print plugin meta data and exit.
 
@@ -207,6 +303,16 @@ Gstr_synopsis = """
 """
 
 
+class WarmupAction(NoArgAction):
+    """
+    Custom action class to bypass required positional arguments when warming
+    up the matplotlib font cache, e.g. while building the container image.
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        LOG(f"Font cache ready in {warm_up()}")
+        parser.exit()
+
+
 class Markimg(ChrisApp):
     """
     An app to mark landmark points and lines on an input image
@@ -358,6 +464,77 @@ class Markimg(ChrisApp):
                           optional=True,
                           help='Offset of additional text on the final output,'
                                'default value is 0,0')
+        self.add_argument('--grayscale',
+                          dest='grayscale',
+                          default=False,
+                          type=bool,
+                          optional=True,
+                          help='If specified, decode the input image as a single channel')
+        self.add_argument('--maxWorkers',
+                          dest='maxWorkers',
+                          default=0,
+                          type=int,
+                          optional=True,
+                          help='Maximum number of rows rendered at once, '
+                               'default value 0 uses all available CPUs')
+        self.add_argument('--profile',
+                          dest='profile',
+                          default='',
+                          type=str,
+                          optional=True,
+                          ui_exposed=False,
+                          help='If specified, save profiling statistics of each row '
+                               'to this directory')
+        self.add_argument('--cohortReport',
+                          dest='cohortReport',
+                          default='',
+                          type=str,
+                          optional=True,
+                          help='Comma separated formats (csv, parquet) of a columnar '
+                               'report of all the rows, empty for none')
+        self.add_argument('--watch',
+                          dest='watch',
+                          default=False,
+                          type=bool,
+                          optional=True,
+                          ui_exposed=False,
+                          help='If specified, keep processing studies as they arrive '
+                               'in the input directory')
+        self.add_argument('--watchInterval',
+                          dest='watchInterval',
+                          default=2.0,
+                          type=float,
+                          optional=True,
+                          ui_exposed=False,
+                          help='Seconds a study must be unchanged for to be processed '
+                               'in watch mode, default value is 2')
+        self.add_argument('--validate',
+                          dest='validate',
+                          default=False,
+                          type=bool,
+                          optional=True,
+                          help='If specified, check all the rows before rendering any')
+        self.add_argument('--skipInvalid',
+                          dest='skipInvalid',
+                          default=False,
+                          type=bool,
+                          optional=True,
+                          help='If specified with --validate, skip the invalid rows '
+                               'instead of failing')
+        self.add_argument('--crop',
+                          dest='crop',
+                          default='',
+                          type=str,
+                          optional=True,
+                          help='Cropped outputs to save around the measured bones, '
+                               'bones or annotated, empty for none')
+        self.add_argument('--cropMargin',
+                          dest='cropMargin',
+                          default=50,
+                          type=int,
+                          optional=True,
+                          help='Margin of the cropped outputs in input image pixels, '
+                               'default value is 50')
         self.add_argument('--outputImageExtension',
                           dest='outputImageExtension',
                           default='jpg',
@@ -365,6 +542,10 @@ class Markimg(ChrisApp):
                           optional=True,
                           help='Generated output image file extension,'
                                'default value is jpg')
+        # not a plugin parameter, the Dockerfile runs it to bake the cache into the image
+        ArgumentParser.add_argument(self, '--warmup', action=WarmupAction,
+                                    dest='warmup', default=False,
+                                    help='build the font cache and exit')
 
     def preamble_show(self, options) -> None:
         """
@@ -390,6 +571,35 @@ class Markimg(ChrisApp):
         """
         self.preamble_show(options)
 
+        if options.profile:
+            os.makedirs(options.profile, exist_ok=True)
+        # statistics of the rows profiled in this run, without older files
+        # of the profile directory
+        self.l_profiles = []
+        if options.crop and options.crop not in CROP_MODES:
+            raise ValueError(f"Unsupported crop mode: {options.crop}")
+        cohort = None
+        if options.cohortReport:
+            # a restarted watcher adds to its report, as its index marks the
+            # rows of the report as done
+            cohort = CohortReport(options.outputdir, options.cohortReport.split(','),
+                                  append=options.watch)
+
+        try:
+            if options.watch:
+                self.watch(options, cohort)
+            else:
+                self.processBatch(options, cohort)
+        finally:
+            if cohort:
+                cohort.close()
+            if options.profile:
+                LOG("Saving profile to %s" % write_collapsed(options.profile, self.l_profiles))
+
+    def processBatch(self, options, cohort):
+        """
+        Process all the rows of the input JSON.
+        """
         # Read json file first
         str_glob = '%s/**/%s' % (options.inputdir, options.inputJsonName)
 
@@ -402,32 +612,216 @@ class Markimg(ChrisApp):
         f = open(jsonFilePath, 'r')
         data = json.load(f)
 
-        d_landmarks = {}
-        d_lines = {}
-        d_lengths = {}
+        # find the images of all the rows in a single walk of the input tree
+        d_images = find_images(options.inputdir, options.inputImageName)
+
+        if options.validate:
+            data = self.validateRows(data, d_images, options)
+            if not data:
+                LOG("No valid rows to process")
+                return
+
+        l_args = []
+        l_estimates = []
+        for row in data:
+            image_path = self.findImage(row, options, d_images)
+            l_args.append((row, data[row], image_path, options))
+            l_estimates.append(estimate_row_memory(*probe_image(image_path)))
+
+        def append_cohort(index, result):
+            cohort.append(cohort_record(l_args[index][0], *result))
+
+        l_results = self.renderRows(_processRow, l_args, l_estimates, options,
+                                    append_cohort if cohort else None)
+
         d_json = {}
         report_json = {}
         row = ""
-        for row in data:
+        for row, (d_row_json, d_report) in zip(data, l_results):
+            d_json[row] = d_row_json
+            report_json.update(d_report)
+
+        self.saveReports(row, d_json, report_json, options.outputdir)
+
+    def validateRows(self, data, d_images, options):
+        """
+        Check all the rows before rendering any, saving the problems found
+        to validation-report.json. Return the valid rows, or raise if some
+        rows are invalid and are not to be skipped.
+        """
+        d_invalid = validate(data, d_images, options.maxWorkers or cpu_count())
+        report_file_path = os.path.join(options.outputdir, 'validation-report.json')
+        LOG(f"{len(d_invalid)} of {len(data)} rows are invalid, saving {report_file_path}")
+        with open(report_file_path, 'w', encoding='utf-8') as jsonf:
+            jsonf.write(json.dumps({'rows': len(data), 'invalid': d_invalid}, indent=4))
+        for row, l_errors in d_invalid.items():
+            logger.error(f"Invalid row {row}: {'; '.join(l_errors)}")
+        if d_invalid and not options.skipInvalid:
+            raise ValueError(f"{len(d_invalid)} invalid rows, see {report_file_path}")
+        return {row: data[row] for row in data if row not in d_invalid}
+
+    def saveReports(self, row, d_json, report_json, outputdir):
+        """
+        Save the analysis and the report JSON, named after the given row.
+        """
+        jsonFilePath = os.path.join(outputdir, f'{row}-analysis.json')
+        report_file_path = os.path.join(outputdir, f'{row}-report.json')
+        # Open a json writer, and use the json.dumps()
+        # function to dump data
+        LOG("Saving %s" % jsonFilePath)
+        with open(jsonFilePath, 'w', encoding='utf-8') as jsonf:
+            jsonf.write(json.dumps(d_json, indent=4))
+        LOG("Saving report as %s" % report_file_path)
+        with open(report_file_path, 'w', encoding='utf-8') as jsonf:
+            jsonf.write(json.dumps(report_json, indent=4))
 
-            file_path = []
-            for root, dirs, files in os.walk(options.inputdir):
-                for dir in dirs:
-                    if dir == row:
-                        dir_path = os.path.join(root, dir)
-                        file_path = glob.glob(dir_path + '/**/' + options.inputImageName, recursive=True)
+    def renderRows(self, fn, l_args, l_estimates, options, callback=None):
+        """
+        Render the rows of l_args with fn, as many at once as fit in the
+        container's memory. Return the results of the rows.
+        """
+        budget = int(memory_limit() * MEMORY_HEADROOM)
+        max_workers = options.maxWorkers or cpu_count()
+        LOG(f"Rendering {len(l_args)} rows with up to {max_workers} workers "
+            f"within {budget // 2**20} MB")
+        mp_context = None
+        if options.watch:
+            # the watcher runs watchdog's threads, a forked worker would inherit
+            # their locks in whatever state they are, so workers are forked
+            # from a single-threaded server which has imported the app
+            mp_context = multiprocessing.get_context('forkserver')
+            mp_context.set_forkserver_preload(['markimg.markimg'])
+
+        # Rows rendered by workers get their image decoded here into shared
+        # memory, which they map rather than receive as a pickled copy
+        shared = SharedImagePool(shm_budget())
+        d_shared = {}
+
+        def prepare(index):
+            row, d_row, image_path, row_options = l_args[index]
+            try:
+                image = decode_image(image_path, row_options.grayscale)
+            except Exception:
+                # the worker reads the image itself and reports the error
+                return l_args[index]
+            shared_image = shared.put(image)
+            if shared_image is None:
+                LOG(f"No room in {SHM_DIR} for the image of row {row}, it is read by its worker")
+                return l_args[index]
+            d_shared[index] = shared_image
+            return l_args[index] + (shared_image,)
+
+        def done(index, result):
+            if index in d_shared:
+                shared.release(d_shared.pop(index))
+            if callback:
+                callback(index, result)
 
-            LOG(f"Reading input image from {file_path[0]}")
-            image = cv2.imread(file_path[0])
-            #image = Image.open(file_path[0])
+        try:
+            l_results = run_admitted(fn, l_args, l_estimates, budget, max_workers, done, mp_context, prepare)
+        finally:
+            shared.close()
+        if options.profile:
+            for args, result in zip(l_args, l_results):
+                path = profile_path(options.profile, args[0])
+                if not isinstance(result, Exception) and path not in self.l_profiles:
+                    self.l_profiles.append(path)
+        return l_results
+
+    def watch(self, options, cohort):
+        """
+        Process the studies of the input directory as they arrive, until
+        interrupted. Each study is saved to its own analysis and report JSON.
+        """
+        watcher = StudyWatcher(options.inputdir, options.outputdir, options.inputJsonName,
+                               options.inputImageName, options.watchInterval)
+        LOG(f"Watching {options.inputdir} for new studies")
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
 
-            plt.style.use('dark_background')
-            plt.axis('off')
+        # stop cleanly, closing the cohort report, when the container is stopped
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while True:
+                l_args = []
+                l_estimates = []
+                l_signatures = []
+                for row, d_row, image_path, signature in watcher.scan():
+                    try:
+                        l_estimates.append(estimate_row_memory(*probe_image(image_path)))
+                    except Exception as e:
+                        logger.error(f"Unable to read the image of row {row}: {e}")
+                        watcher.mark_done(row, signature, str(e))
+                        continue
+                    l_args.append((row, d_row, image_path, options))
+                    l_signatures.append(signature)
+
+                def done(index, result):
+                    row = l_args[index][0]
+                    if isinstance(result, Exception):
+                        watcher.mark_done(row, l_signatures[index], str(result))
+                        return
+                    d_row_json, d_report = result
+                    self.saveReports(row, {row: d_row_json}, d_report, options.outputdir)
+                    if cohort:
+                        cohort.append(cohort_record(row, *result))
+                    watcher.mark_done(row, l_signatures[index])
+
+                if l_args:
+                    self.renderRows(_tryProcessRow, l_args, l_estimates, options, done)
+                    if cohort:
+                        cohort.flush()
+                watcher.wait()
+        except KeyboardInterrupt:
+            LOG("Stopped watching")
+        finally:
+            watcher.close()
+
+    def findImage(self, row, options, d_images=None):
+        """
+        Return the path of the input image of a row, searched for in the
+        directories named after the row, or in d_images if already found.
+        """
+        if d_images is None:
+            d_images = find_images(options.inputdir, options.inputImageName)
+        image_path = row_image(d_images, row)
+        if image_path is None:
+            raise FileNotFoundError(f"No {options.inputImageName} image found for row {row}")
+        return image_path
+
+    def processRow(self, row, d_row, image_path, options, image=None):
+        """
+        Mark the image of a single row and save it to the output directory.
+        Return the analysis and the report of the row. The image is decoded
+        from image_path unless given.
+        """
+        # text sizes are scaled per image, keep the caller's options untouched
+        options = copy.copy(options)
+        d_landmarks = {}
+        d_lines = {}
+        d_lengths = {}
+        report_json = {}
 
-            max_y, max_x, RGB = image.shape
-            #max_x, max_y = image.size
-            fig = plt.figure(figsize=(max_x / 100, max_y / 100))
-            plt.imshow(image)
+        LOG(f"Reading input image from {image_path}")
+        if is_dicom(image_path):
+            # Take the scale from the DICOM header, the pixel data is only
+            # decoded when accessed
+            ds = read_dicom(image_path)
+            height = dicom_height(ds) or d_row.get("origHeight", 0)
+            if image is None:
+                image = dicom_image(ds, options.grayscale)
+        else:
+            height = d_row["origHeight"]
+            if image is None:
+                image = read_image(image_path, options.grayscale)
+
+        max_y, max_x = image.shape[:2]
+        fig = plt.figure(figsize=(max_x / 100, max_y / 100))
+        pool = buffer_pool()
+        rendered = rgb = rotated = None
+        try:
+            plt.imshow(image, **display_args(image))
 
             # autoscale text sizes w.r.t. image
             options.textSize = fig.get_size_inches()[0] * options.textSize
@@ -436,31 +830,39 @@ class Markimg(ChrisApp):
             options.pointSize = fig.get_size_inches()[0] * options.pointSize
 
             img_XY_plane: ImageCanvas = ImageCanvas(max_y, max_x)
-            height = data[row]["origHeight"]
             ht_scale = height / max_x
 
-            info = data[row]['info']
-            details = data[row]['details']
+            info = d_row['info']
+            details = d_row['details']
             report_json.update(details)
 
-            items = data[row]["landmarks"]
+            # Collect all primitives of the row first and draw them in batches,
+            # so that the number of artists does not grow with the landmarks
+            l_points = []
+            items = d_row["landmarks"]
             for item in items:
                 for i in item:
                     point = [item[i]["x"], item[i]["y"]]
                     d_landmarks[i] = point
-                    # Plot points
-                    self.drawPoint(point, options.pointMarker, options.pointColor, options.pointSize)
+                    l_points.append(point)
+            # Plot points
+            self.drawPoints(l_points, options.pointMarker, options.pointColor, options.pointSize)
 
-            items = data[row]["drawXLine"]
+            d_segments = {}
+            d_bone_segments = {}
+            items = d_row["drawXLine"]
             for item in items:
                 for i in item:
                     start = d_landmarks[item[i]["start"]]
                     end = d_landmarks[item[i]["end"]]
                     d_lines[i] = [start, end]
-                    # Draw lines
-                    self.drawXLine(start, end, options.lineColor, max_y, options.linewidth, i)
+                    d_bone_segments[i] = self.xLineSegments(start, end, max_y, i)
+                    d_segments.setdefault(options.lineColor, []).extend(d_bone_segments[i])
+            # Draw lines
+            for color, segments in d_segments.items():
+                self.drawLines(segments, color, options.linewidth)
 
-            items = data[row]["measureXDist"]
+            items = d_row["measureXDist"]
             d_pixel = {}
             for item in items:
                 # Measure distance
@@ -633,44 +1035,63 @@ class Markimg(ChrisApp):
             # Clean up all matplotlib stuff and save as PNG
             plt.tick_params(left=False, right=False, labelleft=False,
                             labelbottom=False, bottom=False)
-            plt.savefig(os.path.join("/tmp", row + "img.jpg"), bbox_inches='tight', pad_inches=0.0)
-            plt.clf()
-
-            # Open an existing image
-            tmpimg = Image.open(os.path.join("/tmp", row + "img.jpg"))
-            x,y = tmpimg.size
-            # Calculate the aspect ratio
-            aspect_ratio = max_x /x
-
-            # Define the target width
-            target_width = int(x * aspect_ratio)
-            target_height = int(y * aspect_ratio)
-
-            # Resize the image
-            resized_image = tmpimg.resize((target_width, target_height))
+            # Render straight into a pooled buffer rather than through a temporary
+            # JPEG, scaling the render to the width of the input image as it is
+            # written so that no full size copy of it is made
+            scale = 1.0
+
+            def resize(rgba):
+                nonlocal scale
+                y, x = rgba.shape[:2]
+                # Calculate the aspect ratio
+                aspect_ratio = max_x / x
+                scale = aspect_ratio
+
+                # Define the target width
+                target_width = int(x * aspect_ratio)
+                target_height = int(y * aspect_ratio)
+
+                # Resize the image
+                resized = pool.acquire((target_height, target_width, 4))
+                cv2.resize(rgba, (target_width, target_height), dst=resized.array,
+                           interpolation=cv2.INTER_AREA if aspect_ratio < 1 else cv2.INTER_CUBIC)
+                return resized
+
+            rendered = pool.writer(resize)
+            plt.savefig(rendered, format='rgba', bbox_inches='tight', pad_inches=0.0)
+            d_crops = {}
+            if options.crop:
+                d_measured = {bone: d_lines[bone] for bone in d_pixel}
+                d_crops = crop_boxes(options.crop, d_measured, d_bone_segments, options.cropMargin)
+                transform = render_transform(fig, plt.gca())
+            plt.close(fig)
+            target_height, target_width = rendered.shape[:2]
+            rgb = pool.acquire((target_height, target_width, 3))
+            cv2.cvtColor(rendered.array(), cv2.COLOR_RGBA2RGB, dst=rgb.array)
 
             # Rotate the image by 90 degrees
-            rotated_image = resized_image.rotate(-90, expand=True)
+            rotated = pool.acquire((target_width, target_height, 3))
+            cv2.rotate(rgb.array, cv2.ROTATE_90_CLOCKWISE, dst=rotated.array)
 
             # Save the resized image
-            rotated_image.save(os.path.join(options.outputdir, row + f".{options.outputImageExtension}"))
+            Image.fromarray(rotated.array).save(os.path.join(options.outputdir,
+                                                             row + f".{options.outputImageExtension}"))
             LOG(f"Input image dimensions {image.shape}")
-            LOG(f"Output image dimensions {rotated_image.size}")
-
-
-            d_json[row] = {'info': d_info, 'femur': d_femur, 'tibia': d_tibia, 'total': d_total,
-                           'pixel_distance': d_pixel, 'details': details}
-
-        jsonFilePath = os.path.join(options.outputdir, f'{row}-analysis.json')
-        report_file_path = os.path.join(options.outputdir, f'{row}-report.json')
-        # Open a json writer, and use the json.dumps()
-        # function to dump data
-        LOG("Saving %s" % jsonFilePath)
-        with open(jsonFilePath, 'w', encoding='utf-8') as jsonf:
-            jsonf.write(json.dumps(d_json, indent=4))
-        LOG("Saving report as %s" % report_file_path)
-        with open(report_file_path, 'w', encoding='utf-8') as jsonf:
-            jsonf.write(json.dumps(report_json, indent=4))
+            LOG(f"Output image dimensions {rotated.array.shape[1::-1]}")
+            # Crop the regions of interest out of the same in-memory image
+            for name, box in d_crops.items():
+                rows, cols = output_slices(box, transform, scale, rotated.array.shape)
+                crop_name = f"{row}-{name.replace(' ', '_')}.{options.outputImageExtension}"
+                Image.fromarray(rotated.array[rows, cols]).save(os.path.join(options.outputdir, crop_name))
+                LOG(f"Saved {crop_name}")
+        finally:
+            # also on errors, as a watcher renders rows for as long as it runs
+            plt.close(fig)
+            pool.release(rendered and rendered.buffer, rgb, rotated)
+
+        d_json = {'info': d_info, 'femur': d_femur, 'tibia': d_tibia, 'total': d_total,
+                  'pixel_distance': d_pixel, 'details': details}
+        return d_json, report_json
 
     def show_man_page(self):
         """
@@ -681,15 +1102,28 @@ class Markimg(ChrisApp):
     def drawPoint(self, point, marker, color, size):
         plt.scatter(point[0], point[1], marker=marker, color=color, s=size)
 
+    def drawPoints(self, points, marker, color, size):
+        """
+        Plot all the given points with a single scatter artist.
+        """
+        if not points:
+            return
+        X, Y = zip(*[(point[0], point[1]) for point in points])
+        plt.scatter(X, Y, marker=marker, color=color, s=size)
+
     def drawLine(self, start, end, color, linewidth):
-        X = []
-        Y = []
-        X.append(start[0])
-        X.append(end[0])
-        Y.append(start[1])
-        Y.append(end[1])
-        # draw connecting lines
-        plt.plot(X, Y, color=color, linewidth=linewidth)
+        self.drawLines([[start, end]], color, linewidth)
+
+    def drawLines(self, segments, color, linewidth):
+        """
+        Draw all the given [start, end] segments with a single LineCollection.
+        """
+        if not segments:
+            return
+        ax = plt.gca()
+        # zorder 2 keeps lines above the points, as plt.plot would
+        ax.add_collection(LineCollection(segments, colors=color, linewidths=linewidth, zorder=2))
+        ax.autoscale_view()
 
     def measureLine(self, line, color, size, unit='px'):
         P1 = line[0]
@@ -731,21 +1165,47 @@ class Markimg(ChrisApp):
             return pixel_distance, pixel_distance
         return pixel_distance, actual_distance
 
-    def drawXLine(self, start, end, color, max_y, linewidth, bone_name):
-        X = []
-        Y = []
-        X.append(start[0])
-        X.append(end[0])
+    def xLineSegments(self, start, end, max_y, bone_name):
+        """
+        Return the segments of a measurement line: the horizontal line
+        along the image border and the two connectors to the landmarks.
+        """
         if "Right" in bone_name:
-            Y.append(max_y - 10)
-            Y.append(max_y - 10)
+            y = max_y - 10
         else:
-            Y.append(10)
-            Y.append(10)
-        # draw connecting lines
-        plt.plot(X, Y, color=color, linewidth=linewidth)
-        P1 = start
-        P2 = [start[0], Y[0]]
-
-        self.drawLine(start, [start[0], Y[0]], color, linewidth)
-        self.drawLine(end, [end[0], Y[1]], color, linewidth)
+            y = 10
+        return [[[start[0], y], [end[0], y]],
+                [start, [start[0], y]],
+                [end, [end[0], y]]]
+
+    def drawXLine(self, start, end, color, max_y, linewidth, bone_name):
+        self.drawLines(self.xLineSegments(start, end, max_y, bone_name), color, linewidth)
+
+
+def _processRow(args):
+    """
+    Render a row, possibly in a worker process where the app itself cannot
+    be pickled and is created anew. The arguments may end with the row's
+    image in shared memory, see Markimg.renderRows().
+    """
+    row, d_row, image_path, options, *l_shared = args
+    app = Markimg()
+    render = app.processRow
+    if options.profile:
+        render = functools.partial(profile_row, options.profile, row, app.processRow)
+    if not l_shared:
+        return render(row, d_row, image_path, options)
+    with l_shared[0] as shared_image:
+        return render(row, d_row, image_path, options, shared_image.array)
+
+
+def _tryProcessRow(args):
+    """
+    Render a row, returning rather than raising its error so that the
+    other rows carry on.
+    """
+    try:
+        return _processRow(args)
+    except Exception as e:
+        logger.exception(f"Unable to process row {args[0]}")
+        return e
@@ -0,0 +1,115 @@
+"""
+Profiling of the rendering of rows, enabled with --profile <dir>.
+Each row is run under cProfile and tracemalloc, writing to <dir>:
+
+    <row>.pstats                cProfile statistics, for pstats/snakeviz
+    <row>-allocations.txt       the lines which allocated the most memory
+
+Once all rows are done, the statistics of the rows of the run are merged
+into markimg.collapsed, a collapsed-stack file for flamegraph.pl or speedscope.
+"""
+
+import cProfile
+import os
+import pstats
+import tracemalloc
+from collections import Counter
+
+TOP_ALLOCATIONS = 25
+# Stacks accounting for less time than this (in seconds) are left out
+# of the collapsed-stack file
+MIN_STACK_TIME = 1e-5
+COLLAPSED_FILE = 'markimg.collapsed'
+
+
+def profile_path(profile_dir: str, row: str) -> str:
+    """
+    Return the path of the cProfile statistics of a row.
+    """
+    return os.path.join(profile_dir, f'{row}.pstats')
+
+
+def profile_row(profile_dir: str, row: str, fn, *args):
+    """
+    Call fn(*args) under cProfile and tracemalloc and write the
+    statistics of the row to profile_dir.
+    :param profile_dir: directory to write the statistics to
+    :param row: name of the row, used to name the files
+    :param fn: function rendering the row
+    :return: the result of fn
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        result = profiler.runcall(fn, *args)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    profiler.dump_stats(profile_path(profile_dir, row))
+    with open(os.path.join(profile_dir, f'{row}-allocations.txt'), 'w') as f:
+        f.write(f'peak traced memory: {peak / 2**20:.1f} MB\n')
+        f.write(f'top {TOP_ALLOCATIONS} allocations still held at the end of the row:\n')
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            f.write(f'{stat}\n')
+    return result
+
+
+def _label(func: tuple) -> str:
+    filename, line, name = func
+    if filename == '~':
+        # built-in functions
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapse_stats(stats: pstats.Stats) -> Counter:
+    """
+    Rebuild call stacks from the caller/callee edges recorded by cProfile.
+    The time of a function is shared between its callers in proportion to
+    the time spent in it from each of them.
+    :param stats: the profile statistics
+    :return: time in microseconds per semicolon separated stack
+    """
+    d_stats = stats.stats
+    d_callees = {}
+    for func, (cc, nc, tt, ct, callers) in d_stats.items():
+        for caller, edge in callers.items():
+            d_callees.setdefault(caller, {})[func] = edge
+
+    stacks = Counter()
+
+    def walk(func, stack, ratio):
+        stack = stack + (func,)
+        self_time = d_stats[func][2] * ratio
+        if self_time > 0:
+            stacks[';'.join(_label(f) for f in stack)] += int(self_time * 1e6)
+        for callee, edge in d_callees.get(func, {}).items():
+            callee_time = d_stats[callee][3]
+            if callee in stack or callee_time <= 0:
+                continue
+            callee_ratio = ratio * edge[3] / callee_time
+            if callee_time * callee_ratio >= MIN_STACK_TIME:
+                walk(callee, stack, callee_ratio)
+
+    for func, (cc, nc, tt, ct, callers) in d_stats.items():
+        if not callers:
+            walk(func, (), 1.0)
+    return stacks
+
+
+def write_collapsed(profile_dir: str, l_files: list) -> str:
+    """
+    Merge the statistics of the given rows into a single collapsed-stack file.
+    :param profile_dir: directory to write the collapsed-stack file to
+    :param l_files: the <row>.pstats files to merge, e.g. those of this run
+    :return: path of the collapsed-stack file
+    """
+    path = os.path.join(profile_dir, COLLAPSED_FILE)
+    stacks = collapse_stats(pstats.Stats(*l_files)) if l_files else Counter()
+    with open(path, 'w') as f:
+        for stack, time in sorted(stacks.items()):
+            if time > 0:
+                f.write(f'{stack} {time}\n')
+    return path
@@ -0,0 +1,99 @@
+"""
+Regions of interest of the output image around the measured bones.
+Boxes are computed in input image coordinates from the landmarks and the
+measurement lines, then mapped to the rendered, resized and rotated output,
+so crops can be cut from the in-memory output buffer.
+"""
+
+import numpy as np
+
+CROP_MODES = ('bones', 'annotated')
+# name of the crop of all the measurements, saved as <row>-crop.<ext>
+ANNOTATED_CROP = 'crop'
+
+# A box is [x0, y0, x1, y1] in input image coordinates
+
+
+def bone_boxes(d_lines: dict, d_segments: dict, margin: float) -> dict:
+    """
+    Return the box of each measured bone, around its landmarks and the
+    segments of its measurement line.
+    :param d_lines: [start, end] landmarks of each bone
+    :param d_segments: segments drawn for each bone, see Markimg.xLineSegments
+    :param margin: margin around the box, in input image pixels
+    :return: box per bone
+    """
+    d_boxes = {}
+    for name, line in d_lines.items():
+        points = np.array(list(line) + [point for segment in d_segments.get(name, []) for point in segment],
+                          dtype=float)
+        x0, y0 = points.min(axis=0) - margin
+        x1, y1 = points.max(axis=0) + margin
+        d_boxes[name] = [x0, y0, x1, y1]
+    return d_boxes
+
+
+def union_box(boxes: list) -> list:
+    """
+    Return the box around all the given boxes.
+    """
+    boxes = np.array(boxes, dtype=float)
+    return [*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0)]
+
+
+def crop_boxes(mode: str, d_lines: dict, d_segments: dict, margin: float) -> dict:
+    """
+    Return the boxes to crop for the given mode, by name.
+    :param mode: 'bones' for a box per bone, 'annotated' for a single box
+    :param d_lines: [start, end] landmarks of each measured bone
+    :param d_segments: segments drawn for each measured bone
+    :param margin: margin around the boxes, in input image pixels
+    :return: box per crop name
+    """
+    if mode not in CROP_MODES:
+        raise ValueError(f"Unsupported crop mode: {mode}")
+    d_boxes = bone_boxes(d_lines, d_segments, margin)
+    if mode == 'annotated' and d_boxes:
+        return {ANNOTATED_CROP: union_box(list(d_boxes.values()))}
+    return d_boxes
+
+
+def render_transform(fig, ax):
+    """
+    Return a function mapping input image coordinates to pixel coordinates
+    (x right, y down) of the figure as saved with bbox_inches='tight'.
+    Call it after saving the figure, once matplotlib has laid out the axes.
+    """
+    dpi = fig.dpi
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer())
+
+    def transform(points):
+        display = ax.transData.transform(np.asarray(points, dtype=float))
+        return np.column_stack([display[:, 0] - bbox.x0 * dpi, bbox.y1 * dpi - display[:, 1]])
+
+    return transform
+
+
+def output_slices(box: list, transform, scale: float, output_shape: tuple) -> tuple:
+    """
+    Map a box to the rows and columns of the output image, which is the
+    render resized by scale and rotated by 90 degrees clockwise.
+    :param box: box in input image coordinates
+    :param transform: function returned by render_transform
+    :param scale: resize factor of the render
+    :param output_shape: shape of the output image
+    :return: the row and column slices of the box in the output image
+    """
+    x0, y0, x1, y1 = box
+    corners = transform([[x0, y0], [x1, y1]]) * scale
+    xs0, ys0 = corners.min(axis=0)
+    xs1, ys1 = corners.max(axis=0)
+    # rotated[r, c] = resized[resized_height - 1 - c, r]
+    resized_height = output_shape[1]
+    rows = _clip(xs0, xs1, output_shape[0])
+    cols = _clip(resized_height - 1 - ys1, resized_height - 1 - ys0, output_shape[1])
+    return rows, cols
+
+
+def _clip(start: float, stop: float, size: int) -> slice:
+    return slice(int(max(np.floor(start), 0)), int(min(np.ceil(stop) + 1, size)))
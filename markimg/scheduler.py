@@ -0,0 +1,124 @@
+"""
+Admission control for rendering several rows at once.
+The peak memory of each row is estimated from its image dimensions before it
+is rendered, and rows are only started while their estimates fit in the memory
+available to the container. A row too large to share the memory is run on its
+own, which falls back to serial processing for giant images.
+"""
+
+import math
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Peak memory of rendering a row, per pixel of the input image. Measured on the
+# Agg backend: matplotlib's float RGBA resampling buffers and the figure canvas
+# dwarf the decoded image, whatever its depth.
+RENDER_BYTES_PER_PIXEL = 120
+# Memory of a worker process once matplotlib, cv2 and PIL are imported
+WORKER_OVERHEAD_BYTES = 200 * 1024 * 1024
+# Fraction of the memory limit given to rows, the rest is kept as headroom
+MEMORY_HEADROOM = 0.8
+
+CGROUP_MEMORY_LIMITS = ('/sys/fs/cgroup/memory.max',
+                        '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+CGROUP_CPU_LIMIT = '/sys/fs/cgroup/cpu.max'
+
+
+def _read_first_line(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return ''
+
+
+def memory_limit() -> int:
+    """
+    Return the memory available to this process in bytes: the cgroup
+    (v2 or v1) memory limit of the container, or the physical memory.
+    :return: the memory limit in bytes
+    """
+    limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in CGROUP_MEMORY_LIMITS:
+        value = _read_first_line(path)
+        if value.isdigit():
+            # unlimited cgroups v1 report a huge number instead of 'max'
+            return min(limit, int(value))
+    return limit
+
+
+def cpu_count() -> int:
+    """
+    Return the number of CPUs this process may use, taking the CPU affinity
+    and the cgroup v2 CPU quota into account.
+    :return: the number of CPUs
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+    quota = _read_first_line(CGROUP_CPU_LIMIT).split()
+    if len(quota) == 2 and quota[0].isdigit():
+        count = min(count, math.ceil(int(quota[0]) / int(quota[1])))
+    return max(count, 1)
+
+
+def estimate_row_memory(width: int, height: int) -> int:
+    """
+    Estimate the peak memory of rendering a row from its image dimensions.
+    :param width: width of the input image in pixels
+    :param height: height of the input image in pixels
+    :return: the estimated peak memory in bytes
+    """
+    return width * height * RENDER_BYTES_PER_PIXEL + WORKER_OVERHEAD_BYTES
+
+
+def run_admitted(fn, l_args: list, l_estimates: list, budget: int, max_workers: int,
+                 callback=None, mp_context=None, prepare=None) -> list:
+    """
+    Call fn on each element of l_args in worker processes, starting a call
+    only while the sum of the memory estimates of the running calls stays
+    within budget. Calls are started in order and at most max_workers run at
+    once; a call which does not fit alongside others is run alone.
+    :param fn: picklable function taking a single argument
+    :param l_args: arguments of the calls
+    :param l_estimates: estimated peak memory of each call in bytes
+    :param budget: memory available to the calls in bytes
+    :param max_workers: maximum number of concurrent calls
+    :param callback: if given, called with the index and the result of
+                     each call as soon as it completes
+    :param mp_context: multiprocessing context of the worker processes,
+                       by default the platform's default start method
+    :param prepare: if given, called with the index of a call just before
+                    it is started in a worker process, returns the argument
+                    to pass to fn instead of the element of l_args
+    :return: the results of the calls, in the order of l_args
+    """
+    l_results = [None] * len(l_args)
+    if max_workers <= 1 or len(l_args) <= 1:
+        for index, args in enumerate(l_args):
+            l_results[index] = fn(args)
+            if callback:
+                callback(index, l_results[index])
+        return l_results
+
+    pending = deque(range(len(l_args)))
+    d_running = {}
+    used = 0
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(l_args)), mp_context=mp_context) as pool:
+        while pending or d_running:
+            while pending and len(d_running) < max_workers and \
+                    (not d_running or used + l_estimates[pending[0]] <= budget):
+                index = pending.popleft()
+                args = prepare(index) if prepare else l_args[index]
+                d_running[pool.submit(fn, args)] = index
+                used += l_estimates[index]
+            done, _ = wait(d_running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = d_running.pop(future)
+                used -= l_estimates[index]
+                l_results[index] = future.result()
+                if callback:
+                    callback(index, l_results[index])
+    return l_results
@@ -0,0 +1,42 @@
+"""
+The matplotlib style of the output images, applied once per process rather
+than for every row. On a cold container the first import of matplotlib also
+builds its font cache; warm_up(), run when the container image is built
+(markimg --warmup), bakes the cache into the image instead.
+"""
+
+import io
+
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib import font_manager
+
+# Frozen rcParams of the output images: matplotlib's dark_background style
+# with a monospace font, so that the report columns line up
+RC_PARAMS = {
+    **matplotlib.style.library['dark_background'],
+    'font.family': ['monospace'],
+}
+
+
+def apply_style() -> None:
+    """
+    Apply the style of the output images to all the figures of the process.
+    """
+    matplotlib.rcParams.update(RC_PARAMS)
+
+
+def warm_up() -> str:
+    """
+    Load (or build and save) the font cache, resolve the font of the style
+    and render some text with it once.
+    :return: the directory of the font cache
+    """
+    apply_style()
+    font_manager.findfont(font_manager.FontProperties(family=RC_PARAMS['font.family']))
+    fig = plt.figure(figsize=(1, 1))
+    plt.imshow([[0, 1]], cmap='gray')
+    plt.text(0, 0, 'warm up', fontsize=10, rotation=90)
+    plt.savefig(io.BytesIO(), format='rgba', bbox_inches='tight', pad_inches=0.0)
+    plt.close(fig)
+    return matplotlib.get_cachedir()
@@ -0,0 +1,86 @@
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+import numpy as np
+
+from markimg.bufferPool import BufferPool, SharedImagePool, MAX_FREE_BUFFERS, SHM_DIR
+
+
+def image_sum(shared_image):
+    with shared_image:
+        return int(shared_image.array.sum())
+
+
+class BufferPoolTests(TestCase):
+    """
+    Test the pool of reused image buffers.
+    """
+    def setUp(self):
+        self.pool = BufferPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_buffers_are_reused(self):
+        buffer = self.pool.acquire((100, 100, 3))
+        self.pool.release(buffer)
+        self.assertIs(self.pool.acquire((90, 100, 3)), buffer)
+
+    def test_much_larger_buffers_are_not_reused(self):
+        buffer = self.pool.acquire((100, 100, 3))
+        self.pool.release(buffer)
+        self.assertIsNot(self.pool.acquire((10, 10, 3)), buffer)
+
+    def test_writer_keeps_shape(self):
+        writer = self.pool.writer()
+        writer.write(memoryview(np.arange(24, dtype=np.uint8).reshape(2, 3, 4)))
+        self.assertEqual(writer.array().shape, (2, 3, 4))
+        self.assertEqual(writer.array()[1, 2, 3], 23)
+
+    def test_free_buffers_are_bounded(self):
+        self.pool.release(*[self.pool.acquire((10, 10)) for i in range(MAX_FREE_BUFFERS + 2)])
+        self.assertEqual(len(self.pool.l_free), MAX_FREE_BUFFERS)
+
+    def test_writer_transform(self):
+        def first_row(array):
+            buffer = self.pool.acquire(array.shape[1:])
+            buffer.array[:] = array[0]
+            return buffer
+
+        writer = self.pool.writer(first_row)
+        writer.write(memoryview(np.arange(24, dtype=np.uint8).reshape(2, 3, 4)))
+        self.assertEqual(writer.array().tolist(), np.arange(12).reshape(3, 4).tolist())
+
+
+class SharedImagePoolTests(TestCase):
+    """
+    Test the shared memory handing images over to worker processes.
+    """
+    def setUp(self):
+        self.pool = SharedImagePool(10000)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_image_is_mapped_by_another_process(self):
+        image = np.arange(600, dtype=np.uint16).reshape(20, 30)
+        shared_image = self.pool.put(image)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(executor.submit(image_sum, shared_image).result(), int(image.sum()))
+
+    def test_segments_are_reused(self):
+        shared_image = self.pool.put(np.zeros((20, 30), dtype=np.uint8))
+        self.pool.release(shared_image)
+        self.assertEqual(self.pool.put(np.ones((20, 20), dtype=np.uint8)).name, shared_image.name)
+
+    def test_budget(self):
+        self.assertIsNotNone(self.pool.put(np.zeros(6000, dtype=np.uint8)))
+        self.assertIsNone(self.pool.put(np.zeros(6000, dtype=np.uint8)))
+
+    def test_close_unlinks(self):
+        shared_image = self.pool.put(np.zeros(100, dtype=np.uint8))
+        self.pool.close()
+        if os.path.isdir(SHM_DIR):
+            self.assertNotIn(shared_image.name.lstrip('/'), os.listdir(SHM_DIR))
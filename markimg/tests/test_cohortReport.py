@@ -0,0 +1,67 @@
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from markimg.cohortReport import CohortReport, cohort_record, COHORT_FILE
+
+ANALYSIS = {'info': {'PatientID': '123'}, 'femur': {'Right femur': '93.8 cm'}, 'details': {'AccessionNumber': 'A1'}}
+REPORT = {'FEMUR RIGHT': '93.8', 'FEMUR LEFT': '93.8', 'FEMUR DIFF': '0.0', 'FEMUR LATERALITY': 'equal:',
+          'TIBIA RIGHT': '105.0', 'TIBIA LEFT': '108.8', 'TIBIA DIFF': '3.8', 'TIBIA LATERALITY': 'left',
+          'TOTAL RIGHT': '198.8', 'TOTAL LEFT': '202.6', 'TOTAL DIFF': '3.8', 'TOTAL LATERALITY': 'left'}
+
+
+class CohortReportTests(TestCase):
+    """
+    Test the columnar cohort report.
+    """
+    def test_record_is_typed(self):
+        d_record = cohort_record('s1', ANALYSIS, REPORT)
+        self.assertEqual(d_record['femur_right'], 93.8)
+        self.assertEqual(d_record['femur_laterality'], 'equal')
+        self.assertEqual(d_record['unit'], 'cm')
+        self.assertEqual(d_record['details'], '{"AccessionNumber": "A1"}')
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as outputdir:
+            cohort = CohortReport(outputdir, ['csv'])
+            cohort.append(cohort_record('s1', ANALYSIS, REPORT))
+            cohort.append(cohort_record('s2', ANALYSIS, REPORT))
+            cohort.close()
+            with open(os.path.join(outputdir, f'{COHORT_FILE}.csv')) as f:
+                l_rows = list(csv.DictReader(f))
+        self.assertEqual([d['row'] for d in l_rows], ['s1', 's2'])
+        self.assertEqual(l_rows[0]['total_diff'], '3.8')
+
+    def test_parquet_parts(self):
+        import pyarrow.parquet as pq
+        with tempfile.TemporaryDirectory() as outputdir:
+            cohort = CohortReport(outputdir, ['parquet'])
+            cohort.append(cohort_record('s1', ANALYSIS, REPORT))
+            cohort.flush()
+            # complete and readable before the report is closed
+            table = pq.read_table(os.path.join(outputdir, f'{COHORT_FILE}.parquet'))
+            self.assertEqual(table.column('row').to_pylist(), ['s1'])
+            cohort.append(cohort_record('s2', ANALYSIS, REPORT))
+            cohort.close()
+            table = pq.read_table(os.path.join(outputdir, f'{COHORT_FILE}.parquet'))
+        self.assertEqual(sorted(table.column('row').to_pylist()), ['s1', 's2'])
+        self.assertEqual(table.column('total_diff').to_pylist(), [3.8, 3.8])
+
+    def test_append(self):
+        import pyarrow.parquet as pq
+        with tempfile.TemporaryDirectory() as outputdir:
+            for row in ('s1', 's2'):
+                cohort = CohortReport(outputdir, ['csv', 'parquet'], append=True)
+                cohort.append(cohort_record(row, ANALYSIS, REPORT))
+                cohort.close()
+            with open(os.path.join(outputdir, f'{COHORT_FILE}.csv')) as f:
+                l_rows = list(csv.DictReader(f))
+            table = pq.read_table(os.path.join(outputdir, f'{COHORT_FILE}.parquet'))
+        self.assertEqual([d['row'] for d in l_rows], ['s1', 's2'])
+        self.assertEqual(sorted(table.column('row').to_pylist()), ['s1', 's2'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            CohortReport('.', ['xlsx'])
@@ -0,0 +1,117 @@
+
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+import pydicom
+
+from markimg.imageReader import read_image, display_args, is_dicom, read_dicom, dicom_height, dicom_image, \
+    find_images, row_image, probe_image
+
+
+class ImageReaderTests(TestCase):
+    """
+    Test the native-format image reader.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, image):
+        path = os.path.join(self.tmpdir.name, name)
+        cv2.imwrite(path, image)
+        return path
+
+    def test_16bit_grayscale_stays_single_channel(self):
+        path = self.write('leg.png', np.full((20, 10), 4000, dtype=np.uint16))
+        image = read_image(path)
+        self.assertEqual(image.shape, (20, 10))
+        self.assertEqual(image.dtype, np.uint16)
+        self.assertEqual(display_args(image)['cmap'], 'gray')
+
+    def test_colour_is_converted_to_rgb(self):
+        bgr = np.zeros((20, 10, 3), dtype=np.uint8)
+        bgr[:, :, 0] = 255
+        image = read_image(self.write('leg.png', bgr))
+        self.assertEqual(image[0, 0].tolist(), [0, 0, 255])
+        self.assertEqual(display_args(image), {})
+
+    def test_grayscale_flag_drops_channels(self):
+        path = self.write('leg.png', np.zeros((20, 10, 3), dtype=np.uint8))
+        self.assertEqual(read_image(path, grayscale=True).shape, (20, 10))
+
+    def test_unreadable_image(self):
+        with self.assertRaises(ValueError):
+            read_image(os.path.join(self.tmpdir.name, 'missing.png'))
+
+    def write_dicom(self, name, pixels, raw=False, **header):
+        ds = pydicom.Dataset()
+        ds.file_meta = pydicom.dataset.FileMetaDataset()
+        ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        ds.file_meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
+        ds.file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+        ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+        ds.Rows, ds.Columns = pixels.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.PixelData = pixels.astype(np.uint16).tobytes()
+        for keyword, value in header.items():
+            setattr(ds, keyword, value)
+        path = os.path.join(self.tmpdir.name, name)
+        if raw:
+            # a bare dataset, without preamble, 'DICM' prefix or file meta
+            del ds.file_meta
+            ds.save_as(path, implicit_vr=True, little_endian=True)
+        else:
+            ds.save_as(path, enforce_file_format=True)
+        return path
+
+    def test_dicom_is_detected_without_extension(self):
+        path = self.write_dicom('leg', np.zeros((4, 6)))
+        self.assertTrue(is_dicom(path))
+        self.assertFalse(is_dicom(self.write('leg.png', np.zeros((4, 6), dtype=np.uint8))))
+
+    def test_dicom_height_from_pixel_spacing(self):
+        ds = read_dicom(self.write_dicom('leg.dcm', np.zeros((4, 6)), PixelSpacing=[0.5, 0.5]))
+        self.assertEqual(dicom_height(ds), 2.0)
+
+    def test_dicom_height_missing(self):
+        ds = read_dicom(self.write_dicom('leg.dcm', np.zeros((4, 6))))
+        self.assertEqual(dicom_height(ds), 0)
+
+    def test_dicom_image_is_rotated(self):
+        pixels = np.arange(24).reshape(4, 6)
+        image = dicom_image(read_dicom(self.write_dicom('leg.dcm', pixels)))
+        self.assertEqual(image.shape, (6, 4))
+        self.assertEqual(image.dtype, np.uint16)
+        self.assertEqual(image[0, 0], pixels[0, -1])
+
+    def test_raw_dicom(self):
+        pixels = np.arange(24).reshape(4, 6)
+        path = self.write_dicom('leg.dcm', pixels, raw=True, PixelSpacing=[0.5, 0.5])
+        self.assertEqual(probe_image(path), (4, 6))
+        ds = read_dicom(path)
+        self.assertEqual(dicom_height(ds), 2.0)
+        self.assertEqual(dicom_image(ds)[0, 0], pixels[0, -1])
+
+    def test_find_images(self):
+        for path in ('a/s1/x/leg.png', 'a/s1/leg.png', 'a/s1/.hidden/leg.png', 'b/s2/leg.png'):
+            os.makedirs(os.path.join(self.tmpdir.name, os.path.dirname(path)), exist_ok=True)
+            self.write(path, np.zeros((2, 2), dtype=np.uint8))
+        d_images = find_images(self.tmpdir.name, 'leg.png')
+        self.assertEqual(d_images['s1'], [os.path.join(self.tmpdir.name, 'a/s1/leg.png'),
+                                          os.path.join(self.tmpdir.name, 'a/s1/x/leg.png')])
+        self.assertEqual(row_image(d_images, 's1'), os.path.join(self.tmpdir.name, 'a/s1/leg.png'))
+        self.assertIsNone(row_image(d_images, 's3'))
+        # only below top, with the directory names of the whole input tree
+        d_images = find_images(self.tmpdir.name, 'leg.png', os.path.join(self.tmpdir.name, 'b'))
+        self.assertEqual(list(d_images), ['b', 's2'])
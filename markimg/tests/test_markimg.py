@@ -1,7 +1,14 @@
 
+import os
+import tempfile
 from unittest import TestCase
 from unittest import mock
-from markimg.markimg import Markimg
+
+import cv2
+import matplotlib.pyplot as plt
+import numpy as np
+
+from markimg.markimg import Markimg, _tryProcessRow
 
 
 class MarkimgTests(TestCase):
@@ -31,3 +38,21 @@ class MarkimgTests(TestCase):
 
         # write your own assertions
         self.assertEqual(options.outputdir, 'outputdir')
+
+    def test_failing_row_closes_its_figure(self):
+        """
+        A row which fails while being drawn leaves no figure open.
+        """
+        # no 'Left femur' is measured, so the report of the row fails
+        d_row = {'origHeight': 100, 'info': {}, 'details': {},
+                 'landmarks': [{'a': {'x': 10, 'y': 10}}, {'b': {'x': 20, 'y': 30}}],
+                 'drawXLine': [{'Right femur': {'start': 'a', 'end': 'b'}}],
+                 'measureXDist': ['Right femur']}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, 'leg.png')
+            cv2.imwrite(image_path, np.zeros((40, 20), dtype=np.uint8))
+            options = self.app.parse_args([tmpdir, tmpdir])
+            plt.close('all')
+            for i in range(3):
+                self.assertIsInstance(_tryProcessRow(('s1', d_row, image_path, options)), KeyError)
+        self.assertEqual(plt.get_fignums(), [])
@@ -0,0 +1,37 @@
+
+import os
+import tempfile
+from unittest import TestCase
+
+from markimg.profiler import profile_path, profile_row, write_collapsed
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+class ProfilerTests(TestCase):
+    """
+    Test the per-row profiling.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_profile_row(self):
+        result = profile_row(self.tmpdir.name, 'row1', work, 1000)
+        self.assertEqual(result, work(1000))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir.name, 'row1.pstats')))
+        with open(os.path.join(self.tmpdir.name, 'row1-allocations.txt')) as f:
+            self.assertTrue(f.readline().startswith('peak traced memory'))
+
+    def test_collapsed_stacks(self):
+        profile_row(self.tmpdir.name, 'row1', work, 200000)
+        profile_row(self.tmpdir.name, 'row2', work, 200000)
+        l_files = [profile_path(self.tmpdir.name, row) for row in ('row1', 'row2')]
+        with open(write_collapsed(self.tmpdir.name, l_files)) as f:
+            l_stacks = [line.rsplit(' ', 1) for line in f]
+        self.assertTrue(any(stack.startswith('work (test_profiler.py') for stack, _ in l_stacks))
+        self.assertTrue(all(int(time) > 0 for _, time in l_stacks))
@@ -0,0 +1,55 @@
+import io
+from unittest import TestCase
+
+import cv2
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from markimg.roi import bone_boxes, crop_boxes, output_slices, render_transform
+
+D_LINES = {'Right femur': [[10, 20], [30, 60]], 'Left femur': [[50, 20], [70, 40]]}
+D_SEGMENTS = {'Right femur': [[[10, 90], [30, 90]], [[10, 20], [10, 90]], [[30, 60], [30, 90]]]}
+
+
+class RoiTests(TestCase):
+    """
+    Test the regions of interest around the measured bones.
+    """
+    def test_bone_boxes(self):
+        d_boxes = bone_boxes(D_LINES, D_SEGMENTS, 5)
+        self.assertEqual(d_boxes['Right femur'], [5, 15, 35, 95])
+        self.assertEqual(d_boxes['Left femur'], [45, 15, 75, 45])
+
+    def test_annotated_crop(self):
+        self.assertEqual(crop_boxes('annotated', D_LINES, D_SEGMENTS, 0), {'crop': [10, 20, 70, 90]})
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            crop_boxes('legs', D_LINES, D_SEGMENTS, 0)
+
+    def test_output_slices(self):
+        resized = np.zeros((40, 60), dtype=np.uint8)
+        resized[10:20, 30:50] = 1
+        rotated = cv2.rotate(resized, cv2.ROTATE_90_CLOCKWISE)
+        # an input image twice the size of the render
+        rows, cols = output_slices([60, 20, 98, 38], lambda points: np.asarray(points) / 2, 1.0,
+                                   rotated.shape)
+        self.assertEqual(rotated[rows, cols].sum(), resized.sum())
+        self.assertEqual(rotated[rows, cols].size, resized.sum())
+
+    def test_render_transform(self):
+        fig = plt.figure(figsize=(2, 1))
+        plt.imshow(np.zeros((100, 200)), cmap='gray', vmin=0, vmax=1)
+        plt.scatter([150], [30], marker='s', color='white', s=4)
+        plt.axis('off')
+        f = io.BytesIO()
+        plt.savefig(f, format='rgba', bbox_inches='tight', pad_inches=0.0)
+        transform = render_transform(fig, plt.gca())
+        plt.close(fig)
+
+        x, y = transform([[150, 30]])[0]
+        width, height = (fig.get_tightbbox().size * fig.dpi).round().astype(int)
+        rgba = np.frombuffer(f.getvalue(), dtype=np.uint8).reshape(height, width, 4)
+        self.assertEqual(rgba[int(y), int(x), 0], 255)
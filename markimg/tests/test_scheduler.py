@@ -0,0 +1,41 @@
+
+import multiprocessing
+from unittest import TestCase
+
+from markimg.scheduler import run_admitted, estimate_row_memory, memory_limit, cpu_count
+
+
+def square(x):
+    return x * x
+
+
+class SchedulerTests(TestCase):
+    """
+    Test the memory-aware row scheduler.
+    """
+    def test_estimate_grows_with_image_size(self):
+        self.assertGreater(estimate_row_memory(2000, 6000), estimate_row_memory(1000, 3000))
+
+    def test_limits(self):
+        self.assertGreater(memory_limit(), 0)
+        self.assertGreaterEqual(cpu_count(), 1)
+
+    def test_serial(self):
+        self.assertEqual(run_admitted(square, [1, 2, 3], [1, 1, 1], 1, 1), [1, 4, 9])
+
+    def test_results_keep_order(self):
+        l_args = list(range(6))
+        self.assertEqual(run_admitted(square, l_args, [1] * 6, 3, 2), [x * x for x in l_args])
+
+    def test_forkserver_workers(self):
+        l_args = list(range(4))
+        self.assertEqual(run_admitted(square, l_args, [1] * 4, 4, 2,
+                                      mp_context=multiprocessing.get_context('forkserver')),
+                         [x * x for x in l_args])
+
+    def test_prepare_replaces_worker_arguments(self):
+        self.assertEqual(run_admitted(square, [1, 2, 3], [1, 1, 1], 3, 2, prepare=lambda index: index + 10),
+                         [100, 121, 144])
+
+    def test_row_larger_than_budget_still_runs(self):
+        self.assertEqual(run_admitted(square, [2, 3], [10, 1], 5, 2), [4, 9])
@@ -0,0 +1,30 @@
+import glob
+import os
+from unittest import TestCase
+
+import matplotlib
+
+from markimg.markimg import Markimg
+from markimg.style import RC_PARAMS, apply_style, warm_up
+
+
+class StyleTests(TestCase):
+    """
+    Test the style of the output images and the font cache warm up.
+    """
+    def test_apply_style(self):
+        with matplotlib.rc_context():
+            matplotlib.rcParams['font.family'] = ['serif']
+            apply_style()
+            self.assertEqual(matplotlib.rcParams['font.family'], ['monospace'])
+            self.assertEqual(matplotlib.rcParams['figure.facecolor'], RC_PARAMS['figure.facecolor'])
+
+    def test_warm_up(self):
+        cachedir = warm_up()
+        self.assertTrue(glob.glob(os.path.join(cachedir, 'fontlist-*.json')))
+
+    def test_warmup_option(self):
+        # exits without the input and output directories
+        with self.assertRaises(SystemExit) as cm:
+            Markimg().parse_args(['--warmup'])
+        self.assertEqual(cm.exception.code, 0)
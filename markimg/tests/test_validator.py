@@ -0,0 +1,56 @@
+
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from markimg.imageReader import find_images
+from markimg.validator import validate, validate_row
+
+ROW = {
+    'origHeight': 1500, 'info': {}, 'details': {},
+    'landmarks': [{'a': {'x': 1, 'y': 2}}, {'b': {'x': 3, 'y': 4}}],
+    'drawXLine': [{name: {'start': 'a', 'end': 'b'}}
+                  for name in ('Right femur', 'Left femur', 'Right tibia', 'Left tibia')],
+    'measureXDist': ['Right femur', 'Left femur', 'Right tibia', 'Left tibia'],
+}
+
+
+class ValidatorTests(TestCase):
+    """
+    Test the pre-flight validation of rows.
+    """
+    def setUp(self):
+        self.inputdir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.inputdir.name, 's1'))
+        self.image = os.path.join(self.inputdir.name, 's1', 'leg.png')
+        cv2.imwrite(self.image, np.zeros((10, 10), dtype=np.uint8))
+
+    def tearDown(self):
+        self.inputdir.cleanup()
+
+    def test_valid_row(self):
+        self.assertEqual(validate_row('s1', ROW, [self.image]), [])
+
+    def test_missing_image(self):
+        self.assertEqual(len(validate_row('s1', ROW, [])), 1)
+
+    def test_unknown_landmark(self):
+        d_row = dict(ROW, drawXLine=ROW['drawXLine'] + [{'Extra': {'start': 'a', 'end': 'z'}}])
+        self.assertEqual(validate_row('s1', d_row, [self.image]),
+                         ["line 'Extra' ends at unknown landmark 'z'"])
+
+    def test_missing_keys(self):
+        d_row = {key: value for key, value in ROW.items() if key not in ('origHeight', 'details')}
+        self.assertEqual(validate_row('s1', d_row, [self.image]),
+                         ["missing key 'origHeight'", "missing key 'details'"])
+
+    def test_validate(self):
+        data = {'s1': ROW, 's2': ROW}
+        d_images = find_images(self.inputdir.name, 'leg.png')
+        self.assertEqual(list(validate(data, d_images, 2)), ['s2'])
+
+    def test_row_is_not_an_object(self):
+        self.assertEqual(validate_row('s1', [], [self.image]), ['row is not an object'])
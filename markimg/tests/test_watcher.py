@@ -0,0 +1,87 @@
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from markimg.watcher import StudyWatcher
+
+
+class StudyWatcherTests(TestCase):
+    """
+    Test the detection of newly arrived studies.
+    """
+    def setUp(self):
+        self.inputdir = tempfile.TemporaryDirectory()
+        self.outputdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.inputdir.cleanup()
+        self.outputdir.cleanup()
+
+    def add_study(self, row, image=True):
+        study_dir = os.path.join(self.inputdir.name, row)
+        os.makedirs(study_dir, exist_ok=True)
+        with open(os.path.join(study_dir, 'prediction.json'), 'w') as f:
+            json.dump({row: {'origHeight': 1}}, f)
+        if image:
+            with open(os.path.join(study_dir, 'leg.png'), 'w') as f:
+                f.write(row)
+
+    def watcher(self, interval=0):
+        return StudyWatcher(self.inputdir.name, self.outputdir.name, 'prediction.json', 'leg.png', interval)
+
+    def test_ready_studies(self):
+        self.add_study('s1')
+        self.add_study('s2', image=False)
+        watcher = self.watcher()
+        try:
+            self.assertEqual([row for row, d_row, image_path, signature in watcher.scan()], ['s1'])
+        finally:
+            watcher.close()
+
+    def test_changing_studies_are_not_ready(self):
+        self.add_study('s1')
+        watcher = self.watcher(interval=3600)
+        try:
+            self.assertEqual(watcher.scan(), [])
+        finally:
+            watcher.close()
+
+    def test_index_persists(self):
+        self.add_study('s1')
+        watcher = self.watcher()
+        try:
+            row, d_row, image_path, signature = watcher.scan()[0]
+            watcher.mark_done(row, signature)
+            self.assertEqual(watcher.scan(), [])
+        finally:
+            watcher.close()
+
+        self.add_study('s2')
+        watcher = self.watcher()
+        try:
+            self.assertEqual([row for row, d_row, image_path, signature in watcher.scan()], ['s2'])
+        finally:
+            watcher.close()
+
+    def test_removed_image_is_not_ready(self):
+        self.add_study('s1')
+        watcher = self.watcher()
+        try:
+            self.assertEqual(len(watcher.scan()), 1)
+            os.remove(os.path.join(self.inputdir.name, 's1', 'leg.png'))
+            self.assertEqual(watcher.scan(), [])
+        finally:
+            watcher.close()
+
+    def test_done_rows_are_evicted(self):
+        self.add_study('s1')
+        watcher = self.watcher()
+        try:
+            row, d_row, image_path, signature = watcher.scan()[0]
+            self.assertIn(row, watcher.d_rows)
+            watcher.mark_done(row, signature)
+            self.assertNotIn(row, watcher.d_rows)
+        finally:
+            watcher.close()
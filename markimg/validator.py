@@ -0,0 +1,76 @@
+"""
+Pre-flight validation of all the rows of a batch, so that a row which would
+fail is reported before hours are spent rendering the rows before it.
+Only image headers are read, and the rows are checked in parallel.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from markimg.imageReader import is_dicom, probe_image
+
+REQUIRED_KEYS = ('info', 'details', 'landmarks', 'drawXLine', 'measureXDist')
+REQUIRED_LENGTHS = ('Right femur', 'Left femur', 'Right tibia', 'Left tibia')
+
+
+def validate_row(row: str, d_row: dict, l_images: list) -> list:
+    """
+    Check that a row has a single readable image and all the landmarks,
+    lines and measurements needed to render it.
+    :param row: name of the row
+    :param d_row: the row's data in the input JSON
+    :param l_images: the images found for the row
+    :return: the problems found, empty if the row is valid
+    """
+    l_errors = []
+    if len(l_images) != 1:
+        l_errors.append(f"expected one image, found {len(l_images)}: {l_images}")
+    if not isinstance(d_row, dict):
+        return l_errors + ['row is not an object']
+    if len(l_images) == 1:
+        try:
+            probe_image(l_images[0])
+            if not is_dicom(l_images[0]) and 'origHeight' not in d_row:
+                l_errors.append("missing key 'origHeight'")
+        except Exception as e:
+            l_errors.append(f"unreadable image {l_images[0]}: {e}")
+
+    l_missing = [key for key in REQUIRED_KEYS if key not in d_row]
+    if l_missing:
+        return l_errors + [f"missing key '{key}'" for key in l_missing]
+
+    try:
+        s_landmarks = set()
+        for item in d_row['landmarks']:
+            for name in item:
+                float(item[name]['x']), float(item[name]['y'])
+                s_landmarks.add(name)
+        s_lines = set()
+        for item in d_row['drawXLine']:
+            for name in item:
+                for end in ('start', 'end'):
+                    if item[name][end] not in s_landmarks:
+                        l_errors.append(f"line '{name}' {end}s at unknown landmark '{item[name][end]}'")
+                s_lines.add(name)
+        for name in d_row['measureXDist']:
+            if name not in s_lines:
+                l_errors.append(f"measurement of unknown line '{name}'")
+        for name in REQUIRED_LENGTHS:
+            if name not in d_row['measureXDist']:
+                l_errors.append(f"missing measurement '{name}'")
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        l_errors.append(f"malformed landmarks or lines: {e!r}")
+    return l_errors
+
+
+def validate(data: dict, d_images: dict, max_workers: int) -> dict:
+    """
+    Validate all the rows of the input JSON in parallel.
+    :param data: the input JSON
+    :param d_images: the input images, see imageReader.find_images()
+    :param max_workers: number of threads reading image headers
+    :return: the problems of each invalid row
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        d_futures = {row: pool.submit(validate_row, row, data[row], d_images.get(row, []))
+                     for row in data}
+    return {row: future.result() for row, future in d_futures.items() if future.result()}
@@ -0,0 +1,251 @@
+"""
+Incremental processing of studies as they arrive in the input directory.
+A study (a row of a prediction JSON) is ready once its JSON and its image are
+both present and have not changed for one polling interval. Rows already
+processed are recorded in a persistent index in the output directory, so that
+a restarted watcher only processes new or modified studies.
+
+Changes are detected with inotify (through watchdog) when it is available:
+only the paths reported by inotify are looked at, and the whole input
+directory is rescanned every RESCAN_INTERVAL seconds in case events were
+missed. Otherwise the input directory is polled.
+"""
+
+import fnmatch
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+from loguru import logger
+
+from markimg.imageReader import find_images, row_image
+
+INDEX_FILE = 'markimg-index.json'
+# with inotify, the input directory is still rescanned this often (in seconds)
+RESCAN_INTERVAL = 60
+# time given to the other files of a study to arrive once one changed (in seconds)
+DEBOUNCE = 0.5
+
+
+class _Wakeup:
+    """
+    watchdog event handler recording the changed paths and waking up the
+    watcher.
+    """
+    def __init__(self, event: threading.Event, s_paths: set, lock: threading.Lock):
+        self.event = event
+        self.s_paths = s_paths
+        self.lock = lock
+
+    def dispatch(self, fs_event) -> None:
+        # reading files, as the watcher and the renderer do, is not a change,
+        # and the files changed in a directory are reported on their own
+        if fs_event.event_type in ('opened', 'closed_no_write') or \
+                (fs_event.is_directory and fs_event.event_type == 'modified'):
+            return
+        with self.lock:
+            self.s_paths.add(fs_event.src_path)
+            if getattr(fs_event, 'dest_path', ''):
+                self.s_paths.add(fs_event.dest_path)
+        self.event.set()
+
+
+class StudyWatcher:
+    def __init__(self, inputdir: str, outputdir: str, json_name: str, image_name: str, interval: float):
+        self.inputdir = inputdir
+        self.json_name = json_name
+        self.image_name = image_name
+        self.interval = interval
+        self.index_path = os.path.join(outputdir, INDEX_FILE)
+        self.d_index = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                self.d_index = json.load(f)
+        # JSON file of every row seen, and the data of the rows which are
+        # not processed yet: processed rows are read again if they change
+        self.d_sources = {}
+        self.d_rows = {}
+        # signature of each JSON file when it was last read
+        self.d_json_signatures = {}
+        # input images below each directory, see imageReader.find_images()
+        self.d_images = {}
+        # JSON files which were changing at the last scan
+        self.s_unsettled = set()
+        # whether the last scan skipped files which were still changing
+        self.unsettled = False
+        self.last_full_scan = None
+        self.changed = threading.Event()
+        self.lock = threading.Lock()
+        self.s_changed = set()
+        self.observer = None
+        if Observer is not None:
+            try:
+                self.observer = Observer()
+                self.observer.schedule(_Wakeup(self.changed, self.s_changed, self.lock), inputdir,
+                                       recursive=True)
+                self.observer.start()
+            except OSError as e:
+                # e.g. the inotify watch limit is reached
+                logger.warning(f"Unable to watch {inputdir} ({e}), polling instead")
+                self.observer = None
+
+    def __is_stable(self, path: str) -> bool:
+        """
+        A file is stable when neither its content nor its metadata changed
+        for a polling interval. Raises FileNotFoundError if it was removed.
+        """
+        stable = time.time() - os.stat(path).st_ctime >= self.interval
+        if not stable:
+            self.unsettled = True
+        return stable
+
+    def __signature(self, path: str) -> list:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime]
+
+    def __forget_json(self, json_path: str) -> None:
+        for row in [row for row, path in self.d_sources.items() if path == json_path]:
+            del self.d_sources[row]
+            self.d_rows.pop(row, None)
+        self.d_json_signatures.pop(json_path, None)
+        self.s_unsettled.discard(json_path)
+
+    def __read_json(self, json_path: str, force: bool = False) -> list:
+        """
+        Read the rows of a JSON file, unless it is unchanged since it was
+        last read and force is False.
+        :return: the rows read
+        """
+        try:
+            if not self.__is_stable(json_path):
+                self.s_unsettled.add(json_path)
+                return []
+            signature = self.__signature(json_path)
+            if not force and self.d_json_signatures.get(json_path) == signature:
+                self.s_unsettled.discard(json_path)
+                return []
+            with open(json_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            # moved or deleted since it was found
+            self.__forget_json(json_path)
+            return []
+        except (OSError, ValueError):
+            self.unsettled = True
+            self.s_unsettled.add(json_path)
+            return []
+        self.__forget_json(json_path)
+        self.d_json_signatures[json_path] = signature
+        for row in data:
+            self.d_sources[row] = json_path
+            self.d_rows[row] = data[row]
+        return list(data)
+
+    def __add_images(self, path: str) -> set:
+        """
+        Update the input images at or below path, e.g. after an inotify event.
+        :return: the rows whose images may have changed
+        """
+        s_rows = set()
+        for row, l_images in list(self.d_images.items()):
+            l_kept = [image for image in l_images if image != path and not image.startswith(path + os.sep)]
+            if len(l_kept) != len(l_images):
+                s_rows.add(row)
+                self.d_images[row] = l_kept
+        if os.path.exists(path):
+            for row, l_images in find_images(self.inputdir, self.image_name, path).items():
+                self.d_images[row] = sorted(self.d_images.get(row, []) + l_images)
+                s_rows.add(row)
+        return s_rows
+
+    def scan(self) -> list:
+        """
+        Return the rows which are ready and not processed yet.
+        :return: list of (row, row data, image path, signature)
+        """
+        self.unsettled = False
+        with self.lock:
+            s_changed = set(self.s_changed)
+            self.s_changed.clear()
+        s_json = set(self.s_unsettled)
+        s_candidates = set(self.d_rows)
+        if self.observer is None or self.last_full_scan is None or \
+                time.monotonic() - self.last_full_scan >= RESCAN_INTERVAL:
+            self.last_full_scan = time.monotonic()
+            self.d_images = find_images(self.inputdir, self.image_name)
+            s_json.update(glob.glob(os.path.join(self.inputdir, '**', self.json_name), recursive=True))
+            s_candidates.update(self.d_sources)
+        else:
+            for path in s_changed:
+                if os.path.isdir(path):
+                    s_json.update(glob.glob(os.path.join(path, '**', self.json_name), recursive=True))
+                    s_candidates.update(self.__add_images(path))
+                elif fnmatch.fnmatch(os.path.basename(path), self.json_name):
+                    s_json.add(path)
+                elif fnmatch.fnmatch(os.path.basename(path), self.image_name) or not os.path.exists(path):
+                    s_candidates.update(self.__add_images(path))
+        for json_path in sorted(s_json):
+            s_candidates.update(self.__read_json(json_path))
+
+        l_ready = []
+        for row in sorted(s_candidates):
+            json_path = self.d_sources.get(row)
+            image_path = row_image(self.d_images, row)
+            if json_path is None or image_path is None:
+                continue
+            try:
+                if not (self.__is_stable(json_path) and self.__is_stable(image_path)):
+                    continue
+                signature = [json_path, image_path,
+                             self.__signature(json_path), self.__signature(image_path)]
+            except FileNotFoundError:
+                # moved or deleted since it was found, not ready
+                continue
+            if self.d_index.get(row, {}).get('signature') == signature:
+                self.d_rows.pop(row, None)
+                continue
+            if row not in self.d_rows:
+                # processed before and changed since
+                self.__read_json(json_path, force=True)
+            if row in self.d_rows:
+                l_ready.append((row, self.d_rows[row], image_path, signature))
+        return l_ready
+
+    def mark_done(self, row: str, signature: list, error: str = '') -> None:
+        """
+        Record a row as processed, so it is skipped until its files change.
+        """
+        self.d_index[row] = {'signature': signature, 'error': error}
+        self.d_rows.pop(row, None)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.d_index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def wait(self) -> None:
+        """
+        Wait until the input directory may hold new ready studies: poll
+        every interval, or with inotify, wait for a change, or for the files
+        which were changing to be stable.
+        """
+        if self.observer is None:
+            time.sleep(self.interval)
+            return
+        # inotify may miss events, e.g. on network filesystems
+        timeout = self.interval if self.unsettled else RESCAN_INTERVAL
+        if self.changed.wait(timeout):
+            # a study arrives as several files, let the others follow
+            time.sleep(DEBOUNCE)
+        self.changed.clear()
+
+    def close(self) -> None:
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()